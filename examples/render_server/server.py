@@ -6,46 +6,695 @@
 
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from socketserver import ThreadingMixIn, ForkingMixIn
-from dataclasses import dataclass
 from random import random
 from math import pi, cos, sin, acos
 from pathlib import Path
 from pyospray import *
 import numpy as np
 from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import concurrent.futures
 import logging
-from collections import deque
-from queue import Queue
+import threading
+import time
+from collections import deque, OrderedDict, Counter
+from contextlib import contextmanager
 from PIL import Image
 from io import BytesIO
+from urllib.parse import urlsplit, parse_qs
+import base64
+import hashlib
 
 
 print = partial(print, flush=True)
 
 
-_g_scenes = Queue()
+_g_scenes = None
+_g_encoder = None
+_g_frames = None
+_g_model = None
+_g_prefetcher = None
+_g_flights = None
+_g_metrics = None
+_g_data_cache = DataCache(max_bytes=64 * 2**20)
 WIDTH, HEIGHT = (256, 256)
+ACQUIRE_TIMEOUT = 5.0
+MAX_PENDING = 4
+MAX_STREAM_FPS = 60.0
 BG = (38, 36, 54, 0)
 
 
+class Histogram:
+	"""A Prometheus histogram of durations in seconds."""
+	
+	buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+	
+	def __init__(self, name, help):
+		self.name = name
+		self.help = help
+		self._lock = threading.Lock()
+		self._counts = [0] * len(Histogram.buckets)
+		self._sum = 0.0
+		self._count = 0
+	
+	def observe(self, value):
+		with self._lock:
+			for i, bound in enumerate(Histogram.buckets):
+				if value <= bound:
+					self._counts[i] += 1
+					break
+			self._sum += value
+			self._count += 1
+	
+	@contextmanager
+	def time(self):
+		"""Observe how long the block takes."""
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe(time.perf_counter() - start)
+	
+	def expose(self):
+		with self._lock:
+			counts = list(self._counts)
+			total = self._sum
+			count = self._count
+		
+		lines = [
+			f'# HELP {self.name} {self.help}',
+			f'# TYPE {self.name} histogram',
+		]
+		cumulative = 0
+		for bound, n in zip(Histogram.buckets, counts):
+			cumulative += n
+			lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+		lines.append(f'{self.name}_bucket{{le="+Inf"}} {count}')
+		lines.append(f'{self.name}_sum {total}')
+		lines.append(f'{self.name}_count {count}')
+		return lines
+
+
+class Metrics:
+	"""Where the server's time goes, in the Prometheus text format.
+	
+	Histograms time each stage of a request; gauges and counters are
+	read from the pool, caches and prefetcher when exposed.
+	
+	In forking mode every request is served by a child process whose
+	observations are lost when it exits, so only the parent's (pool,
+	caches) are exposed.
+	
+	"""
+	
+	def __init__(self):
+		self.slot_wait = Histogram('render_server_slot_wait_seconds', 'Time waiting for a scene from the pool.')
+		self.camera_commit = Histogram('render_server_camera_commit_seconds', 'Time committing the camera.')
+		self.renderer_commit = Histogram('render_server_renderer_commit_seconds', 'Time committing the renderer, model and other changed objects.')
+		self.render = Histogram('render_server_render_seconds', 'Time in ospRenderFrame.')
+		self.readback = Histogram('render_server_readback_seconds', 'Time reading pixels from the framebuffer.')
+		self.encode = Histogram('render_server_encode_seconds', 'Time encoding frames.')
+		self.write = Histogram('render_server_write_seconds', 'Time writing responses to the socket.')
+		self._lock = threading.Lock()
+		self._statuses = Counter()
+		self._in_progress = 0
+	
+	def responded(self, status):
+		with self._lock:
+			self._statuses[status] += 1
+	
+	@contextmanager
+	def in_progress(self):
+		"""Count a frame request for the duration of the block."""
+		with self._lock:
+			self._in_progress += 1
+		try:
+			yield
+		finally:
+			with self._lock:
+				self._in_progress -= 1
+	
+	def expose(self):
+		"""Return all metrics in the Prometheus text format."""
+		lines = []
+		for histogram in (self.slot_wait, self.camera_commit, self.renderer_commit, self.render, self.readback, self.encode, self.write):
+			lines.extend(histogram.expose())
+		
+		with self._lock:
+			statuses = dict(self._statuses)
+			in_progress = self._in_progress
+		lines.append('# HELP render_server_responses_total Responses sent, by status code.')
+		lines.append('# TYPE render_server_responses_total counter')
+		for status, count in sorted(statuses.items()):
+			lines.append(f'render_server_responses_total{{code="{status}"}} {count}')
+		
+		pool = _g_scenes.stats()
+		frames = _g_frames.stats()
+		flights = _g_flights.stats()
+		gauges = [
+			('render_server_requests_in_progress', 'Frame requests being served.', in_progress),
+			('render_server_pool_size', 'Scenes in the pool.', pool['size']),
+			('render_server_pool_in_use', 'Scenes rendering.', pool['in_use']),
+			('render_server_pool_occupancy', 'Fraction of the maximum pool size in use.', pool['occupancy']),
+			('render_server_pool_waiting', 'Requests queued for a scene.', pool['waiting']),
+			('render_server_frame_cache_bytes', 'Bytes of encoded frames cached.', frames['bytes']),
+			('render_server_frame_cache_hit_rate', 'Fraction of frame cache lookups that hit.', frames['hit_rate']),
+			('render_server_flights_in_progress', 'Distinct frames being rendered for requests.', flights['in_flight']),
+		]
+		for name, help, value in gauges:
+			lines.append(f'# HELP {name} {help}')
+			lines.append(f'# TYPE {name} gauge')
+			lines.append(f'{name} {value}')
+		
+		counters = [
+			('render_server_frame_cache_hits_total', 'Frame cache hits.', frames['hits']),
+			('render_server_frame_cache_misses_total', 'Frame cache misses.', frames['misses']),
+			('render_server_frame_cache_evictions_total', 'Frames evicted from the cache.', frames['evictions']),
+			('render_server_coalesced_total', 'Requests that shared another request\'s render.', flights['coalesced']),
+			('render_server_pool_timeouts_total', 'Requests that got no scene in time.', pool['timeouts']),
+		]
+		if _g_prefetcher is not None:
+			prefetch = _g_prefetcher.stats()
+			counters.append(('render_server_prefetch_rendered_total', 'Frames rendered ahead of requests.', prefetch['rendered']))
+			counters.append(('render_server_prefetch_cancelled_total', 'Predicted frames cancelled before rendering.', prefetch['cancelled']))
+		for name, help, value in counters:
+			lines.append(f'# HELP {name} {help}')
+			lines.append(f'# TYPE {name} counter')
+			lines.append(f'{name} {value}')
+		
+		return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+class FrameEncoder:
+	"""Encode frames on a pool of worker threads.
+	
+	Frames are read into staging buffers from a free list, so a scene
+	can go back to the pool as soon as its pixels are copied out and
+	the next render overlaps with encoding (and sending) this one.
+	
+	"""
+	
+	content_types = {
+		'jpeg': 'image/jpeg',
+		'png': 'image/png',
+		'raw': 'application/octet-stream',
+	}
+	
+	def __init__(self, size, format='jpeg', quality=90, workers=2):
+		self.size = size
+		self.format = format
+		self.quality = quality
+		self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='encode')
+		self._lock = threading.Lock()
+		self._free = []
+		self._local = threading.local()
+	
+	@property
+	def content_type(self):
+		return FrameEncoder.content_types[self.format]
+	
+	def settings(self, quality=None):
+		"""Return what, besides the pose, determines the output."""
+		return (self.size, self.format, self.quality if quality is None else quality)
+	
+	def staging_buffer(self):
+		"""Return a buffer for one frame's RGB pixels."""
+		with self._lock:
+			if self._free:
+				return self._free.pop()
+		width, height = self.size
+		return bytearray(width * height * 3)
+	
+	def recycle(self, buffer):
+		"""Give back a staging buffer that won't be encoded."""
+		with self._lock:
+			self._free.append(buffer)
+	
+	def submit(self, buffer, quality=None):
+		"""Encode a staging buffer, returning a future of the bytes.
+		
+		The buffer is recycled once it has been encoded. `quality`
+		overrides the encoder's JPEG quality for this frame.
+		
+		"""
+		if quality is None:
+			quality = self.quality
+		return self._executor.submit(self._encode, buffer, quality)
+	
+	def _encode(self, buffer, quality):
+		try:
+			if self.format == 'raw':
+				return bytes(buffer)
+			
+			f = getattr(self._local, 'file', None)
+			if f is None:
+				f = self._local.file = BytesIO()
+			f.seek(0)
+			f.truncate()
+			
+			with _g_metrics.encode.time():
+				image = Image.frombuffer('RGB', self.size, buffer, 'raw', 'RGB', 0, 1)
+				if self.format == 'jpeg':
+					image.save(f, 'JPEG', quality=quality)
+				elif self.format == 'png':
+					image.save(f, 'PNG', compress_level=1)
+				else:
+					raise NotImplementedError
+				return f.getvalue()
+		finally:
+			self.recycle(buffer)
+
+
+class FrameCache:
+	"""Encoded frames keyed by scene, camera pose and settings.
+	
+	Poses are quantized to multiples of `quantum`, so requests for
+	poses closer than that share a frame. Frames are stored along
+	with the :func:`scene_version` they were rendered at; once a
+	scene is seen with a newer version all of its frames are
+	dropped. The least recently used frames are evicted to stay
+	within `max_bytes`.
+	
+	"""
+	
+	def __init__(self, max_bytes, quantum=1e-3):
+		self.max_bytes = max_bytes
+		self.quantum = quantum
+		self.nbytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.invalidations = 0
+		self._lock = threading.Lock()
+		self._entries = OrderedDict()
+		self._versions = {}
+	
+	def key(self, scene, pose, settings):
+		"""Return the cache key for a frame."""
+		return (scene, tuple(round(value / self.quantum) for value in pose), settings)
+	
+	def get(self, key, version):
+		"""Return the frame for `key`, or None if it isn't cached."""
+		with self._lock:
+			self._saw_version(key[0], version)
+			content = self._entries.get(key)
+			if content is None:
+				self.misses += 1
+				return None
+			self.hits += 1
+			self._entries.move_to_end(key)
+			return content
+	
+	def put(self, key, version, content):
+		"""Cache a frame rendered at scene version `version`."""
+		with self._lock:
+			self._saw_version(key[0], version)
+			if version != self._versions[key[0]] or len(content) > self.max_bytes:
+				return
+			
+			old = self._entries.pop(key, None)
+			if old is not None:
+				self.nbytes -= len(old)
+			self._entries[key] = content
+			self.nbytes += len(content)
+			
+			while self.nbytes > self.max_bytes:
+				_, evicted = self._entries.popitem(last=False)
+				self.nbytes -= len(evicted)
+				self.evictions += 1
+	
+	def contains(self, key, version):
+		"""Return whether `key` is cached, without counting a lookup."""
+		with self._lock:
+			self._saw_version(key[0], version)
+			return key in self._entries
+	
+	def stats(self):
+		"""Return a dict of the cache's size and hit counts."""
+		with self._lock:
+			lookups = self.hits + self.misses
+			return {
+				'entries': len(self._entries),
+				'bytes': self.nbytes,
+				'max_bytes': self.max_bytes,
+				'hits': self.hits,
+				'misses': self.misses,
+				'hit_rate': self.hits / lookups if lookups else 0.0,
+				'evictions': self.evictions,
+				'invalidations': self.invalidations,
+			}
+	
+	def _saw_version(self, scene, version):
+		"""Drop a scene's frames if `version` is newer than theirs."""
+		if version <= self._versions.get(scene, -1):
+			return
+		self._versions[scene] = version
+		stale = [key for key in self._entries if key[0] == scene]
+		for key in stale:
+			self.nbytes -= len(self._entries.pop(key))
+		self.invalidations += len(stale)
+
+
+class SingleFlight:
+	"""Let concurrent requests for the same frame share one render.
+	
+	The first request for a key leads: it makes the frame and hands
+	it to every request for the same key that arrives before it is
+	done, which wait for it instead of rendering it again.
+	
+	"""
+	
+	def __init__(self):
+		self.led = 0
+		self.coalesced = 0
+		self._lock = threading.Lock()
+		self._flights = {}
+	
+	def join(self, key):
+		"""Return ``(future, leader)`` for a request for `key`.
+		
+		A leader must make the result and pass it to
+		:meth:`~.SingleFlight.finish`; the others wait on `future`.
+		
+		"""
+		with self._lock:
+			future = self._flights.get(key)
+			if future is not None:
+				self.coalesced += 1
+				return future, False
+			
+			# Running futures can't be cancelled, so a follower that
+			# gives up can't cancel the result for the others.
+			future = concurrent.futures.Future()
+			future.set_running_or_notify_cancel()
+			self._flights[key] = future
+			self.led += 1
+			return future, True
+	
+	def finish(self, key, future, result=None, exception=None):
+		"""Hand the leader's result (or exception) to the followers."""
+		with self._lock:
+			del self._flights[key]
+		if exception is not None:
+			future.set_exception(exception)
+		else:
+			future.set_result(result)
+	
+	def run(self, key, function):
+		"""Return ``function()``, or the result of the flight in progress."""
+		future, leader = self.join(key)
+		if not leader:
+			return future.result()
+		try:
+			result = function()
+		except BaseException as error:
+			self.finish(key, future, exception=error)
+			raise
+		self.finish(key, future, result)
+		return result
+	
+	async def run_async(self, key, function):
+		"""Like :meth:`~.SingleFlight.run`, awaiting ``function()``.
+		
+		The leader's ``function()`` runs as a task of its own, so
+		cancelling the leader (e.g. when its client goes away) doesn't
+		cancel the render the followers are waiting for.
+		
+		"""
+		future, leader = self.join(key)
+		if not leader:
+			return await asyncio.shield(asyncio.wrap_future(future))
+		
+		def finished(task):
+			if task.cancelled():
+				self.finish(key, future, exception=asyncio.CancelledError())
+			elif task.exception() is not None:
+				self.finish(key, future, exception=task.exception())
+			else:
+				self.finish(key, future, task.result())
+		
+		task = asyncio.ensure_future(function())
+		task.add_done_callback(finished)
+		return await asyncio.shield(task)
+	
+	def stats(self):
+		"""Return a dict of how many requests led and joined flights."""
+		with self._lock:
+			return {
+				'in_flight': len(self._flights),
+				'led': self.led,
+				'coalesced': self.coalesced,
+			}
+
+
+class Prefetcher:
+	"""Render the poses clients are likely to ask for next.
+	
+	The last few poses of each client (by address) are kept, and
+	after every request the next `horizon` poses are extrapolated
+	from them and rendered into the frame cache, but only on scenes
+	that are idle at the time, always leaving one idle for the next
+	real request and never while a request waits for a scene. A
+	client's next request cancels the predictions made from its
+	previous one that haven't started.
+	
+	The history lives in the server process, so this does nothing
+	useful in forking mode.
+	
+	"""
+	
+	def __init__(self, horizon=3, history=3, workers=1, max_clients=1024):
+		self.horizon = horizon
+		self.history = history
+		self.max_clients = max_clients
+		self.issued = 0
+		self.rendered = 0
+		self.skipped = 0
+		self.cancelled = 0
+		self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+		self._lock = threading.Lock()
+		self._clients = OrderedDict()
+	
+	def observe(self, client, pose):
+		"""Record a requested pose and prefetch what follows it."""
+		with self._lock:
+			history, pending = self._clients.pop(client, (None, []))
+			if history is None:
+				history = deque(maxlen=self.history)
+			history.append(pose)
+			
+			for future in pending:
+				if future.cancel():
+					self.cancelled += 1
+			
+			pending = [
+				self._executor.submit(self._prefetch, predicted)
+				for predicted in extrapolate(history, self.horizon)
+			]
+			self.issued += len(pending)
+			
+			self._clients[client] = (history, pending)
+			while len(self._clients) > self.max_clients:
+				self._clients.popitem(last=False)
+	
+	def stats(self):
+		"""Return a dict of prefetch counts."""
+		with self._lock:
+			return {
+				'clients': len(self._clients),
+				'issued': self.issued,
+				'rendered': self.rendered,
+				'skipped': self.skipped,
+				'cancelled': self.cancelled,
+			}
+	
+	def _prefetch(self, pose):
+		version = scene_version(_g_model)
+		key = _g_frames.key(id(_g_model), pose, _g_encoder.settings())
+		if _g_frames.contains(key, version):
+			return
+		
+		scene = _g_scenes.try_acquire(keep_idle=1)
+		if scene is None:
+			with self._lock:
+				self.skipped += 1
+			return
+		
+		# Lead a flight, so requests for this pose that arrive while
+		# it renders wait for it, but don't wait on anyone else's.
+		flight = (key, version)
+		future, leader = _g_flights.join(flight)
+		if not leader:
+			_g_scenes.release(scene)
+			return
+		try:
+			content = render_encoded(scene, pose).result()
+			_g_frames.put(key, version, content)
+		except BaseException as error:
+			_g_flights.finish(flight, future, exception=error)
+			raise
+		_g_flights.finish(flight, future, content)
+		with self._lock:
+			self.rendered += 1
+
+
+def extrapolate(history, steps):
+	"""Return the `steps` poses that continue the ones in `history`.
+	
+	The poses are extrapolated with constant acceleration (or
+	velocity, with only two poses), which follows smooth orbits
+	closely over a few frames.
+	
+	"""
+	if len(history) < 2:
+		return []
+	
+	poses = np.array(history, dtype='float64')
+	velocity = poses[-1] - poses[-2]
+	if not velocity.any():
+		return []
+	acceleration = 0.0
+	if len(poses) >= 3:
+		acceleration = poses[-1] - 2 * poses[-2] + poses[-3]
+	
+	return [
+		tuple((poses[-1] + step * velocity + step * step / 2 * acceleration).tolist())
+		for step in range(1, steps + 1)
+	]
+
+
+def draw(scene, pose, buffer):
+	"""Render `pose` on `scene` and read its pixels into `buffer`."""
+	x, y, z, ux, uy, uz, vx, vy, vz = pose
+	camera = scene.camera
+	camera.pos = (x, y, z)
+	camera.up = (ux, uy, uz)
+	camera.dir = (vx, vy, vz)
+	
+	# Only what changed is committed; the camera's commits are
+	# told apart from the rest of the scene's.
+	commits = {'camera': 0.0, 'scene': 0.0}
+	
+	def committed(obj, seconds):
+		commits['camera' if obj is camera else 'scene'] += seconds
+	
+	start = time.perf_counter()
+	scene.render(OSP_FB_COLOR, on_commit=committed)
+	elapsed = time.perf_counter() - start
+	
+	_g_metrics.camera_commit.observe(commits['camera'])
+	_g_metrics.renderer_commit.observe(commits['scene'])
+	_g_metrics.render.observe(elapsed - commits['camera'] - commits['scene'])
+	with _g_metrics.readback.time():
+		scene.framebuffer.read_pixels(buffer, 'rgb')
+
+
+def render_encoded(scene, pose, quality=None):
+	"""Render `pose` and return a future of the encoded frame.
+	
+	The scene is given back to the pool as soon as the pixels have
+	been read, before encoding.
+	
+	"""
+	buffer = _g_encoder.staging_buffer()
+	try:
+		draw(scene, pose, buffer)
+	except BaseException:
+		_g_encoder.recycle(buffer)
+		raise
+	finally:
+		_g_scenes.release(scene)
+	return _g_encoder.submit(buffer, quality)
+
+
+def parse_pose(path):
+	"""Return the nine numbers of a pose path, or None if it isn't one."""
+	try:
+		pose = tuple(map(float, path.strip('/').split('/')))
+	except ValueError:
+		return None
+	if len(pose) != 9:
+		return None
+	return pose
+
+
+def random_path():
+	"""Return the image path of a random pose looking at the origin."""
+	u = random()
+	v = random()
+	theta = 2 * pi * u
+	phi = acos(2 * v - 1)
+	r = 200
+	x = r * sin(phi) * cos(theta)
+	y = r * sin(phi) * sin(theta)
+	z = r * cos(phi)
+	
+	return f'/{x}/{y}/{z}/0/1/0/{-x}/{-y}/{-z}'
+
+
+def get_frame(pose, client, quality=None):
+	"""Return the encoded frame for `pose`, from the cache if possible.
+	
+	Concurrent requests for the same frame are coalesced into one
+	render. Raises :class:`PoolTimeout` when no scene became
+	available.
+	
+	"""
+	version = scene_version(_g_model)
+	key = _g_frames.key(id(_g_model), pose, _g_encoder.settings(quality))
+	
+	def render():
+		with _g_metrics.slot_wait.time():
+			scene = _g_scenes.acquire(timeout=ACQUIRE_TIMEOUT)
+		content = render_encoded(scene, pose, quality).result()
+		_g_frames.put(key, version, content)
+		return content
+	
+	content = _g_frames.get(key, version)
+	if content is None:
+		with _g_metrics.in_progress():
+			content = _g_flights.run((key, version), render)
+	
+	if _g_prefetcher is not None:
+		_g_prefetcher.observe(client, pose)
+	return content
+
+
+async def get_frame_async(pose, client, quality=None):
+	"""Return the encoded frame for `pose` without blocking the loop."""
+	version = scene_version(_g_model)
+	key = _g_frames.key(id(_g_model), pose, _g_encoder.settings(quality))
+	
+	async def render():
+		with _g_metrics.slot_wait.time():
+			scene = await _g_scenes.acquire_async(timeout=ACQUIRE_TIMEOUT)
+		loop = asyncio.get_event_loop()
+		future = await loop.run_in_executor(None, render_encoded, scene, pose, quality)
+		content = await asyncio.wrap_future(future)
+		_g_frames.put(key, version, content)
+		return content
+	
+	content = _g_frames.get(key, version)
+	if content is None:
+		with _g_metrics.in_progress():
+			content = await _g_flights.run_async((key, version), render)
+	
+	if _g_prefetcher is not None:
+		_g_prefetcher.observe(client, pose)
+	return content
+
+
 class TapestryRequestHandler(BaseHTTPRequestHandler):
 	def do_GET(self):
 		if self.path == '/':
 			self.do_GET_index()
 		elif self.path == '/random':
-			u = random()
-			v = random()
-			theta = 2 * pi * u
-			phi = acos(2 * v - 1)
-			r = 200
-			x = r * sin(phi) * cos(theta)
-			y = r * sin(phi) * sin(theta)
-			z = r * cos(phi)
-			
-			self.path = f'/{x}/{y}/{z}/0/1/0/{-x}/{-y}/{-z}'
-			#print(self.path)
+			self.path = random_path()
 			self.do_GET_image()
 			
+		elif self.path == '/metrics':
+			self.do_GET_metrics()
 		elif self.path == '/favicon.ico':
 			self.send_error(404)
 		else:
@@ -59,91 +708,382 @@ class TapestryRequestHandler(BaseHTTPRequestHandler):
 		self.end_headers()
 		self.wfile.write(content)
 	
-	def _do_GET_image(self, scene):
-		x, y, z, ux, uy, uz, vx, vy, vz = map(float, self.path[1:].split('/'))
-		with committing(scene.camera) as camera:
-			camera.pos = (x, y, z)
-			camera.up = (ux, uy, uz)
-			camera.dir = (vx, vy, vz)
+	def do_GET_metrics(self):
+		content = _g_metrics.expose()
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/plain; version=0.0.4')
+		self.send_header('Content-Length', str(len(content)))
+		self.end_headers()
+		self.wfile.write(content)
+	
+	def do_GET_image(self):
+		pose = parse_pose(self.path)
+		if pose is None:
+			self.send_error(404)
+			return
 		
-		scene.renderer.commit()
+		try:
+			content = get_frame(pose, self.client_address[0])
+		except PoolTimeout:
+			self.send_error(503)
+			return
 		
-		scene.fb.clear(OSP_FB_COLOR)
-		scene.renderer.render(scene.fb, OSP_FB_COLOR)
-		data = ospToPixels(b"rgb", scene.size, scene.fb._ospray_object)
-		return data
+		self.send_response(200)
+		self.send_header('Content-Type', _g_encoder.content_type)
+		self.send_header('Content-Length', str(len(content)))
+		self.end_headers()
+		with _g_metrics.write.time():
+			self.wfile.write(content)
 	
-	def do_GET_image(self):
-		scene = None
+	def send_response(self, code, message=None):
+		_g_metrics.responded(code)
+		super().send_response(code, message)
+	
+	def log_message(*args):
+		pass
+
+
+class AsyncConnection:
+	"""Serve one keep-alive HTTP connection on the event loop.
+	
+	Requests are read as they arrive and answered in order, but when
+	several image requests are waiting only the newest pose is
+	rendered and every one of them is answered with that frame, so
+	a client sending poses faster than they can be rendered never
+	waits on stale frames. At most `MAX_PENDING` requests are read
+	ahead; after that the connection stops reading until responses
+	have been written, which pushes back on the client through TCP.
+	
+	A WebSocket upgrade hands the connection over to a
+	:class:`FrameStream` once the requests before it are answered.
+	
+	"""
+	
+	def __init__(self, reader, writer):
+		self.reader = reader
+		self.writer = writer
+		self.client = writer.get_extra_info('peername')[0]
+		self.requests = deque()
+		self.arrived = asyncio.Event()
+		self.room = asyncio.Event()
+		self.room.set()
+		self.dropped = 0
+	
+	async def serve(self):
+		responder = asyncio.ensure_future(self.respond())
+		upgrade = None
 		try:
-			try:
-				scene = _g_scenes.get()
-			except IndexError:
-				print('making new scene')
-				scene = make_scene()
+			while not responder.done():
+				await self.room.wait()
+				request = await self.read_request()
+				if request is None:
+					break
+				if request[2] is not None:
+					upgrade = request
+					break
+				self.requests.append(request)
+				if len(self.requests) >= MAX_PENDING:
+					self.room.clear()
+				self.arrived.set()
+		except (ConnectionError, ValueError):
+			pass
+		finally:
+			self.requests.append(None)
+			self.arrived.set()
+		
+		try:
+			closed = await responder
+			if upgrade is not None and not closed:
+				path, _, key = upgrade
+				await FrameStream(self.reader, self.writer, self.client).serve(path, key)
+		except ConnectionError:
+			pass
+		finally:
+			self.writer.close()
+	
+	async def read_request(self):
+		"""Return ``(path, keep_alive, websocket_key)`` of the next request.
 		
-			data = self._do_GET_image(scene)
+		`websocket_key` is None unless the request is a WebSocket
+		upgrade. Returns None at the end of the connection.
+		
+		"""
+		line = await self.reader.readline()
+		if not line:
+			return None
+		method, path, version = line.decode('latin-1').split()
+		
+		headers = {}
+		while True:
+			line = await self.reader.readline()
+			if line in (b'\r\n', b'\n', b''):
+				break
+			name, _, value = line.decode('latin-1').partition(':')
+			headers[name.strip().lower()] = value.strip()
+		
+		connection = headers.get('connection', '').lower()
+		if version == 'HTTP/1.0':
+			keep_alive = connection == 'keep-alive'
+		else:
+			keep_alive = connection != 'close'
+		
+		websocket_key = None
+		if headers.get('upgrade', '').lower() == 'websocket':
+			websocket_key = headers.get('sec-websocket-key')
+		return path, keep_alive, websocket_key
+	
+	async def respond(self):
+		"""Answer requests until the connection ends.
+		
+		Returns whether the connection was closed because a request
+		asked for that.
+		
+		"""
+		while True:
+			await self.arrived.wait()
+			self.arrived.clear()
+			
+			batch = list(self.requests)
+			self.requests.clear()
+			self.room.set()
+			
+			poses = {}
+			for request in batch:
+				if request is None:
+					continue
+				path, _, _ = request
+				if path == '/random':
+					path = random_path()
+				if path not in ('/', '/favicon.ico', '/metrics'):
+					pose = parse_pose(path)
+					if pose is not None:
+						poses[request] = pose
 			
-			image = Image.frombytes('RGB', (WIDTH, HEIGHT), data, 'raw')
-			f = BytesIO()
-			image.save(f, 'JPEG')
+			content = None
+			if poses:
+				self.dropped += len(poses) - 1
+				try:
+					content = await get_frame_async(list(poses.values())[-1], self.client)
+				except PoolTimeout:
+					pass
 			
-			self.send_response(200)
-			self.send_header('Content-Type', 'image/jpeg')
-			self.end_headers()
-			self.wfile.write(f.getvalue())
+			for request in batch:
+				if request is None:
+					return False
+				path, keep_alive, _ = request
+				if path == '/':
+					index = (Path.cwd() / 'index.html').read_bytes()
+					self.write_response(200, 'text/html', index, keep_alive)
+				elif path == '/metrics':
+					self.write_response(200, 'text/plain; version=0.0.4', _g_metrics.expose(), keep_alive)
+				elif request not in poses:
+					self.write_response(404, 'text/plain', b'Not Found', keep_alive)
+				elif content is None:
+					self.write_response(503, 'text/plain', b'Service Unavailable', keep_alive)
+				else:
+					self.write_response(200, _g_encoder.content_type, content, keep_alive)
+				with _g_metrics.write.time():
+					await self.writer.drain()
+				if not keep_alive:
+					self.writer.close()
+					return True
+	
+	def write_response(self, status, content_type, content, keep_alive):
+		reason = {200: 'OK', 404: 'Not Found', 503: 'Service Unavailable'}[status]
+		_g_metrics.responded(status)
+		self.writer.write(
+			f'HTTP/1.1 {status} {reason}\r\n'
+			f'Content-Type: {content_type}\r\n'
+			f'Content-Length: {len(content)}\r\n'
+			f'Connection: {"keep-alive" if keep_alive else "close"}\r\n'
+			f'\r\n'.encode('latin-1')
+		)
+		self.writer.write(content)
+
+
+class FrameStream:
+	"""Stream frames over a WebSocket as the client moves the camera.
+	
+	The client sends poses as text messages (the nine numbers of an
+	image path, separated by slashes) and gets encoded frames back as
+	binary messages. Only the newest pose is rendered, so poses that
+	arrive while a frame is being made replace each other. Frames are
+	sent at most `fps` times a second and with the given JPEG
+	`quality`, both taken from the query string, e.g.
+	``/stream?fps=30&quality=70``.
+	
+	"""
+	
+	GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+	MAX_MESSAGE = 2**16
+	
+	TEXT = 0x1
+	BINARY = 0x2
+	CLOSE = 0x8
+	PING = 0x9
+	PONG = 0xA
+	
+	def __init__(self, reader, writer, client):
+		self.reader = reader
+		self.writer = writer
+		self.client = client
+		self.pose = None
+		self.posed = asyncio.Event()
+		self.fps = MAX_STREAM_FPS
+		self.quality = None
+	
+	async def serve(self, path, key):
+		query = parse_qs(urlsplit(path).query)
+		if 'fps' in query:
+			self.fps = min(max(float(query['fps'][0]), 1.0), MAX_STREAM_FPS)
+		if 'quality' in query:
+			self.quality = min(max(int(query['quality'][0]), 1), 95)
+		
+		accept = base64.b64encode(hashlib.sha1(key.encode('ascii') + FrameStream.GUID).digest())
+		self.writer.write(
+			b'HTTP/1.1 101 Switching Protocols\r\n'
+			b'Upgrade: websocket\r\n'
+			b'Connection: Upgrade\r\n'
+			b'Sec-WebSocket-Accept: ' + accept + b'\r\n'
+			b'\r\n'
+		)
+		
+		sender = asyncio.ensure_future(self.send_frames())
+		try:
+			await self.receive()
+		except (asyncio.IncompleteReadError, ValueError):
+			pass
 		finally:
-			assert scene is not None
-			_g_scenes.put(scene)
+			sender.cancel()
+			try:
+				await sender
+			except asyncio.CancelledError:
+				pass
 	
-	def log_message(*args):
-		pass
+	async def receive(self):
+		"""Read poses until the client closes the stream."""
+		message = bytearray()
+		while True:
+			fin, opcode, payload = await self.read_frame()
+			if opcode == FrameStream.CLOSE:
+				self.write_frame(FrameStream.CLOSE, payload[:2])
+				return
+			elif opcode == FrameStream.PING:
+				self.write_frame(FrameStream.PONG, payload)
+			elif opcode == FrameStream.PONG:
+				pass
+			else:
+				message += payload
+				if len(message) > FrameStream.MAX_MESSAGE:
+					raise ValueError('message too large')
+				if fin:
+					self.received(bytes(message))
+					message.clear()
+	
+	def received(self, message):
+		try:
+			pose = parse_pose(message.decode('ascii'))
+		except UnicodeDecodeError:
+			return
+		if pose is not None:
+			self.pose = pose
+			self.posed.set()
+	
+	async def send_frames(self):
+		"""Send a frame of the newest pose whenever one arrives."""
+		loop = asyncio.get_event_loop()
+		interval = 1.0 / self.fps
+		next_frame = loop.time()
+		while True:
+			await self.posed.wait()
+			delay = next_frame - loop.time()
+			if delay > 0:
+				await asyncio.sleep(delay)
+			next_frame = loop.time() + interval
+			
+			self.posed.clear()
+			try:
+				content = await get_frame_async(self.pose, self.client, self.quality)
+			except PoolTimeout:
+				self.posed.set()
+				continue
+			
+			self.write_frame(FrameStream.BINARY, content)
+			with _g_metrics.write.time():
+				await self.writer.drain()
+	
+	async def read_frame(self):
+		"""Return ``(fin, opcode, payload)`` of the next frame."""
+		head = await self.reader.readexactly(2)
+		fin = bool(head[0] & 0x80)
+		opcode = head[0] & 0x0F
+		length = head[1] & 0x7F
+		if length == 126:
+			length = int.from_bytes(await self.reader.readexactly(2), 'big')
+		elif length == 127:
+			length = int.from_bytes(await self.reader.readexactly(8), 'big')
+		if length > FrameStream.MAX_MESSAGE:
+			raise ValueError('frame too large')
+		
+		mask = None
+		if head[1] & 0x80:
+			mask = await self.reader.readexactly(4)
+		payload = await self.reader.readexactly(length)
+		if mask is not None:
+			payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+		return fin, opcode, payload
+	
+	def write_frame(self, opcode, payload):
+		length = len(payload)
+		if length < 126:
+			head = bytes((0x80 | opcode, length))
+		elif length < 2**16:
+			head = bytes((0x80 | opcode, 126)) + length.to_bytes(2, 'big')
+		else:
+			head = bytes((0x80 | opcode, 127)) + length.to_bytes(8, 'big')
+		self.writer.write(head)
+		self.writer.write(payload)
 
 
-@dataclass
-class Scene:
-	camera: Camera
-	renderer: Renderer
-	size: osp_vec2i
-	fb: FrameBuffer
+async def serve_async(port):
+	async def connected(reader, writer):
+		await AsyncConnection(reader, writer).serve()
 	
+	server = await asyncio.start_server(connected, '', port, backlog=100)
+	async with server:
+		await server.serve_forever()
 
-def make_scene():
+
+def make_model():
 	with committing(PiecewiseLinear()) as transferFunction:
 		colors = np.array(builtin.colormaps['coolToWarm'], dtype='float32')
-		with releasing(Data(OSP_FLOAT3, colors, 0)) as data:
-			data.commit()
+		with _g_data_cache.acquiring(OSP_FLOAT3, colors) as data:
 			transferFunction.colors = data
 		
 		opacities = 0.6 * np.array(builtin.opacitymaps['ramp'], dtype='float32')
-		with releasing(Data(OSP_FLOAT, opacities, 0)) as data:
-			data.commit()
+		with _g_data_cache.acquiring(OSP_FLOAT, opacities) as data:
 			transferFunction.opacities = data
 		
 		transferFunction.valueRange = (0.0, 255.0)
 	
-	with committing(StructuredVolume()) as volume:
-		voxels = np.fromfile('teapot.raw', dtype='float32').T
-		#print(voxels.min(), voxels.max(), len(voxels.flat))
-		with releasing(Data(OSP_FLOAT, voxels, 0)) as data:
-			data.commit()
-			volume.voxelData = data
-
+	with committing(StructuredVolume.from_raw('teapot.raw', (256, 256, 178), 'float32')) as volume:
 		volume.transferFunction = transferFunction
 		volume.voxelRange = (0.0, 255.0)
-		volume.dimensions = (256, 256, 178)
 		volume.gridOrigin = (-256/2, -256/2, -178/2)
-		volume.voxelType = b'float'
 	
+	with committing(Model()) as model:
+		model.add(volume)
+	
+	return model
+
+
+def make_scene(model):
 	with committing(PerspectiveCamera()) as camera:
 		camera.aspect = WIDTH / HEIGHT
 		camera.pos = (0, 0, 0)
 		camera.dir = (0.1, 0, 0.1)
 		camera.up = (0, 1, 0)
 
-	with committing(Model()) as model:
-		model.add(volume)
-
 	with committing(SciVis()) as renderer:
 		renderer.spp = 4
 		renderer.bgColor = (BG[0]/255, BG[1]/255, BG[2]/255, BG[3]/255)
@@ -157,12 +1097,7 @@ def make_scene():
 		
 	fb = FrameBuffer(size, OSP_FB_SRGBA, OSP_FB_COLOR)
 	
-	return Scene(
-		camera,
-		renderer,
-		size,
-		fb,
-	)
+	return RenderContext(camera, renderer, fb)
 
 
 class MyHTTPServer(HTTPServer):
@@ -177,7 +1112,9 @@ class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
 	request_queue_size = 100
 
 
-def main(port, verbose, mode):
+def main(port, verbose, mode, min_scenes, max_scenes, encode_format, quality, encode_workers, frame_cache_mb, pose_quantum, prefetch):
+	global _g_scenes, _g_encoder, _g_frames, _g_model, _g_prefetcher, _g_flights, _g_metrics
+	
 	error = ospInit([]);
 	if error != OSP_NO_ERROR:
 		raise Exception('Error occurred', err)
@@ -191,14 +1128,40 @@ def main(port, verbose, mode):
 		server_class = ForkingHTTPServer
 	elif mode == 'normal':
 		server_class = MyHTTPServer
+	elif mode == 'asyncio':
+		server_class = None
 	else:
 		raise NotImplementedError
 
-	for _ in range(3):
-		_g_scenes.put(make_scene())
+	_g_metrics = Metrics()
+	_g_model = make_model()
+	_g_scenes = RenderContextPool(
+		partial(make_scene, _g_model),
+		min_size=min_scenes,
+		max_size=max_scenes,
+		idle_timeout=60.0,
+	)
+	_g_encoder = FrameEncoder(
+		(WIDTH, HEIGHT),
+		format=encode_format,
+		quality=quality,
+		workers=encode_workers,
+	)
+	_g_frames = FrameCache(frame_cache_mb * 2**20, quantum=pose_quantum)
+	_g_flights = SingleFlight()
+	if mode == 'forking':
+		print('Request metrics are not collected in forking mode')
+		if prefetch:
+			print('Prefetching is ignored in forking mode')
+	elif prefetch:
+		_g_prefetcher = Prefetcher(horizon=prefetch)
 	
 	print(f'Listening at {port}...')
 	
+	if server_class is None:
+		asyncio.run(serve_async(port))
+		return
+	
 	server = server_class(('', port), TapestryRequestHandler)
 	server.serve_forever()
 
@@ -211,7 +1174,15 @@ def cli():
 	
 	parser.add_argument('--port', type=int, default=8819)
 	parser.add_argument('-v', '--verbose', action='store_true')
-	parser.add_argument('--mode', choices=('threading', 'forking', 'normal'), default='normal')
+	parser.add_argument('--mode', choices=('threading', 'forking', 'normal', 'asyncio'), default='normal')
+	parser.add_argument('--min-scenes', type=int, default=3)
+	parser.add_argument('--max-scenes', type=int, default=8)
+	parser.add_argument('--encode-format', choices=('jpeg', 'png', 'raw'), default='jpeg')
+	parser.add_argument('--quality', type=int, default=90)
+	parser.add_argument('--encode-workers', type=int, default=2)
+	parser.add_argument('--frame-cache-mb', type=int, default=64)
+	parser.add_argument('--pose-quantum', type=float, default=1e-3)
+	parser.add_argument('--prefetch', type=int, default=0, help='poses to render ahead per client (0 to disable)')
 	
 	args = vars(parser.parse_args())
 	
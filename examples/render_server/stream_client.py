@@ -0,0 +1,152 @@
+#!/usr/bin/env python3.7
+"""
+Stream frames from the render server over its WebSocket endpoint
+
+The camera is moved around the same orbit as in index.html, sending the
+next pose as soon as a frame arrives. Run the server with ``--mode
+asyncio`` first.
+
+"""
+
+
+from math import pi, cos, sin
+from pathlib import Path
+from functools import partial
+import asyncio
+import base64
+import hashlib
+import os
+import time
+
+
+print = partial(print, flush=True)
+
+
+GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+BINARY = 0x2
+TEXT = 0x1
+CLOSE = 0x8
+PING = 0x9
+PONG = 0xA
+
+
+async def connect(host, port, path):
+	reader, writer = await asyncio.open_connection(host, port)
+	
+	key = base64.b64encode(os.urandom(16))
+	writer.write(
+		f'GET {path} HTTP/1.1\r\n'
+		f'Host: {host}:{port}\r\n'
+		f'Upgrade: websocket\r\n'
+		f'Connection: Upgrade\r\n'
+		f'Sec-WebSocket-Key: {key.decode("ascii")}\r\n'
+		f'Sec-WebSocket-Version: 13\r\n'
+		f'\r\n'.encode('latin-1')
+	)
+	
+	status = await reader.readline()
+	if b' 101 ' not in status:
+		raise ConnectionError(f'upgrade refused: {status!r}')
+	
+	accept = base64.b64encode(hashlib.sha1(key + GUID).digest())
+	while True:
+		line = await reader.readline()
+		if line in (b'\r\n', b''):
+			break
+		name, _, value = line.partition(b':')
+		if name.strip().lower() == b'sec-websocket-accept' and value.strip() != accept:
+			raise ConnectionError('bad Sec-WebSocket-Accept')
+	
+	return reader, writer
+
+
+def write_frame(writer, opcode, payload):
+	# Frames from clients must be masked.
+	mask = os.urandom(4)
+	length = len(payload)
+	if length < 126:
+		head = bytes((0x80 | opcode, 0x80 | length))
+	elif length < 2**16:
+		head = bytes((0x80 | opcode, 0x80 | 126)) + length.to_bytes(2, 'big')
+	else:
+		head = bytes((0x80 | opcode, 0x80 | 127)) + length.to_bytes(8, 'big')
+	writer.write(head + mask + bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload)))
+
+
+async def read_frame(reader):
+	head = await reader.readexactly(2)
+	opcode = head[0] & 0x0F
+	length = head[1] & 0x7F
+	if length == 126:
+		length = int.from_bytes(await reader.readexactly(2), 'big')
+	elif length == 127:
+		length = int.from_bytes(await reader.readexactly(8), 'big')
+	return opcode, await reader.readexactly(length)
+
+
+def orbit(radius):
+	theta = 0.0
+	while True:
+		theta += 0.01 * pi
+		x = radius * cos(theta)
+		y = radius * sin(theta)
+		z = 0
+		yield f'/{x}/{y}/{z}/0/1/0/{-x}/{-y}/{-z}'
+
+
+async def main(host, port, frames, fps, quality, radius, save):
+	path = f'/stream?fps={fps}'
+	if quality is not None:
+		path += f'&quality={quality}'
+	reader, writer = await connect(host, port, path)
+	
+	if save is not None:
+		save.mkdir(parents=True, exist_ok=True)
+	
+	poses = orbit(radius)
+	write_frame(writer, TEXT, next(poses).encode('ascii'))
+	
+	received = 0
+	nbytes = 0
+	start = time.monotonic()
+	while received < frames:
+		opcode, payload = await read_frame(reader)
+		if opcode == BINARY:
+			received += 1
+			nbytes += len(payload)
+			if save is not None:
+				(save / f'frame{received:05d}.jpg').write_bytes(payload)
+			write_frame(writer, TEXT, next(poses).encode('ascii'))
+		elif opcode == PING:
+			write_frame(writer, PONG, payload)
+		elif opcode == CLOSE:
+			break
+	elapsed = time.monotonic() - start
+	
+	write_frame(writer, CLOSE, (1000).to_bytes(2, 'big'))
+	await writer.drain()
+	writer.close()
+	
+	print(f'{received} frames, {nbytes / max(received, 1) / 1024:.1f} KiB each, {received / elapsed:.2f} fps')
+
+
+def cli():
+	import argparse
+	
+	parser = argparse.ArgumentParser()
+	
+	parser.add_argument('--host', default='localhost')
+	parser.add_argument('--port', type=int, default=8819)
+	parser.add_argument('--frames', type=int, default=200)
+	parser.add_argument('--fps', type=float, default=30.0)
+	parser.add_argument('--quality', type=int)
+	parser.add_argument('--radius', type=float, default=5.0)
+	parser.add_argument('--save', type=Path)
+	
+	args = vars(parser.parse_args())
+	
+	asyncio.run(main(**args))
+
+
+if __name__ == '__main__':
+	cli()
@@ -63,12 +63,7 @@ def main():
 		with committing(AmbientLight()) as light:
 			pass
 		
-		lights = np.array([
-			light,
-		], dtype=object)
-		with releasing(Data(OSP_LIGHT, lights, 0)) as lights:
-			lights.commit()
-			renderer.lights = lights
+		renderer.lights = [light]
 	
 	size = osp_vec2i()
 	size.x = WIDTH
@@ -17,12 +17,21 @@ __ https://www.ospray.org/documentation.html
 """
 
 from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from .pyospray import *
 from .builtin import *
+import numpy as np
+import asyncio
+import concurrent.futures
+import itertools
 import logging
+import threading
+import time
+import weakref
 
 
 _logger = None
+_commit_serials = itertools.count(1)
 
 def get_logger():
 	global _logger
@@ -31,6 +40,37 @@ def get_logger():
 	return _logger
 
 
+_render_executor = None
+_render_executor_lock = threading.Lock()
+
+def get_render_executor():
+	"""Return the executor used to render frames in the background.
+	
+	Unless one was given to :func:`set_render_executor`, this is a
+	thread pool of two workers: OSPRay already uses every core for a
+	single frame, so more workers only help to overlap the Python
+	work around each frame.
+	
+	"""
+	global _render_executor
+	with _render_executor_lock:
+		if _render_executor is None:
+			_render_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='pyospray-render')
+		return _render_executor
+
+
+def set_render_executor(executor):
+	"""Render frames in the background with `executor`.
+	
+	Returns the previous executor, which is not shut down.
+	
+	"""
+	global _render_executor
+	with _render_executor_lock:
+		previous, _render_executor = _render_executor, executor
+	return previous
+
+
 @contextmanager
 def committing(obj):
 	"""Commit the object after the context manager block."""
@@ -45,6 +85,80 @@ def releasing(obj):
 	obj.release()
 
 
+def commit_dirty(*roots, on_commit=None):
+	"""Commit the changed objects reachable from `roots`.
+	
+	The graph is followed through the objects set as parameters
+	(e.g. renderer to model and camera, volume to transfer function)
+	and those added to models. Objects are committed children first,
+	when they have uncommitted changes of their own, or when one of
+	their children was committed and their class sets
+	``_commit_with_children``. :class:`~.Model` does, since its
+	commit is what finalizes the geometries and volumes in it and
+	rebuilds its acceleration structure, and so does
+	:class:`~.Instance`. Other OSPRay objects see their children's
+	commits without being committed again, so e.g. changing a
+	transfer function commits only it and not the volume or model
+	that use it.
+	
+	`on_commit`, if not None, is called with each committed object
+	and the seconds its commit took.
+	
+	Returns the committed objects in the order they were committed.
+	
+	"""
+	committed = []
+	visited = {}
+	
+	def visit(obj):
+		key = id(obj)
+		if key in visited:
+			return visited[key]
+		visited[key] = False
+		
+		dirty = obj._dirty
+		for child in obj._children():
+			if visit(child) and obj._commit_with_children:
+				dirty = True
+		
+		if dirty:
+			if on_commit is None:
+				obj.commit()
+			else:
+				start = time.perf_counter()
+				obj.commit()
+				on_commit(obj, time.perf_counter() - start)
+			committed.append(obj)
+		visited[key] = dirty
+		return dirty
+	
+	for root in roots:
+		visit(root)
+	return committed
+
+
+def scene_version(*roots):
+	"""Return a number that changes whenever the scene is re-committed.
+	
+	This is the latest commit of any object reachable from `roots`
+	(followed like in :func:`~.commit_dirty`), so it can be stored
+	with something derived from the scene, e.g. a rendered image, to
+	tell later whether that is out of date.
+	
+	"""
+	version = 0
+	visited = set()
+	pending = list(roots)
+	while pending:
+		obj = pending.pop()
+		if id(obj) in visited:
+			continue
+		visited.add(id(obj))
+		version = max(version, obj._commit_serial)
+		pending.extend(obj._children())
+	return version
+
+
 # Thanks https://stackoverflow.com/a/6849299
 class lazy_property(object):
 	"""
@@ -64,52 +178,6 @@ class lazy_property(object):
 		return value
 
 
-class ManagedObjectMeta(type):
-	"""Metaclass reserved for future use."""
-	pass
-
-
-class ManagedObject(metaclass=ManagedObjectMeta):
-	"""Base class for all OSPRay objects
-	
-	Subclasses should override or extend the
-	:meth:`~.ManagedObject._make_ospray_object` method and return
-	an appropriate OSPRay object (e.g. `ospNewGeometry(...)`).
-
-	Any attributes that can be set (e.g. with `ospSet3f(...)` or
-	similar methods) can use the :class:`~.Committer` descriptor
-	in their class definition to automatically have getters/setters
-	with the appropriate types.
-	
-	"""
-	
-	@lazy_property
-	def _logger(self):
-		"""Return the appropriate logger."""
-		return get_logger()
-	
-	@lazy_property
-	def _ospray_object(self):
-		"""Return the OSPRay object instance."""
-		self._logger.debug('new %s', self.__class__.__name__)
-		obj = self._make_ospray_object()
-		assert obj is not None
-		return obj
-	
-	def _make_ospray_object(self, *args, **kwargs):
-		"""Make the low-level OSPRay object and return it."""
-		raise NotImplementedError
-
-	def commit(self):
-		"""Commit any changes to OSPRay."""
-		self._logger.debug('ospCommit(%s)', self.__class__.__name__)
-		ospCommit(self._ospray_object)
-	
-	def release(self):
-		self._logger.debug('ospRelease(%s)', self.__class__.__name__)
-		ospRelease(self._ospray_object)
-
-
 class Committer(object):
 	"""Automatical type-correct setters for managed objects.
 	
@@ -126,16 +194,13 @@ class Committer(object):
 	  foo = ospNewFoo()
 	  setVec2f(foo, 'myattr', 1.0, 2.0)
 	
-	Note: In the future, this may also set a dirty flag on the object
-	so that commits aren't missed.
+	Setting an attribute also marks the object dirty, so that
+	:func:`~.commit_dirty` knows to commit it. The value is kept on
+	the object, so ``foo.myattr`` reads it back and setting the same
+	value again skips the call into OSPRay.
 	
 	"""
 	
-	@lazy_property
-	def _logger(self):
-		"""Return the module logger."""
-		return get_logger()
-		
 	def __init__(self, type):
 		"""Create the committer with the right type.
 		
@@ -145,27 +210,65 @@ class Committer(object):
 		official documentation.
 		
 		"""
+		self.type = type
 		self.setter = Committer.get_ospray_setter(type)
+		self.kind = Committer.get_ospray_kind(self.setter)
+		self.attr = None
 		self.name = None
 
 	def __get__(self, obj, objtype=None):
-		"""Return the attributes value.
-		
-		Note: Not currently implemented, but it may be in
-		the future.
-		
-		"""
-		raise NotImplementedError()
+		"""Return the value the attribute was last set to."""
+		if obj is None:
+			return self
+		try:
+			return obj._params[self.attr]
+		except KeyError:
+			raise AttributeError(f'{obj.__class__.__name__}.{self.attr} has not been set') from None
 	
 	def __set__(self, obj, value):
 		"""Call the low-level OSPRay method to set the attribute."""
+		if self.type in Committer.object_array_types and not isinstance(value, ManagedObject):
+			self._set_objects(obj, value)
+			return
+		
+		params = obj._params
+		if self.attr in params and Committer._same(params[self.attr], value):
+			return
+		
 		ospray_object = obj._ospray_object
+		tracer = ManagedObject._tracer
+		if tracer is not None:
+			start = tracer.now()
 		if isinstance(value, tuple):
 			args = value
 		else:
 			args = (value,)
-		self._logger.debug('set %s.%s = %r using %s', obj.__class__.__name__, self.name, args, self.setter.__name__)
 		self.setter(ospray_object, self.name, *args)
+		if tracer is not None:
+			tracer.complete(start, 'set', obj.__class__.__name__, {'name': self.attr})
+		obj._dirty = True
+		params[self.attr] = value
+		if isinstance(value, ManagedObject):
+			obj._reference(self.name, value)
+	
+	def _set_objects(self, obj, objects):
+		"""Set a list of objects through a :class:`~.Data` of them.
+		
+		The data is remembered, and setting the same objects again
+		(e.g. every frame) is a no-op instead of a new upload. The
+		attribute reads back as a list of the objects, not the data.
+		
+		"""
+		objects = list(objects)
+		data = obj._references.get(self.name)
+		if isinstance(data, Data) and data._holds(objects):
+			return
+		
+		type = Committer.object_array_types[self.type]
+		with releasing(Data(type, objects, Data.NONE)) as data:
+			data.commit()
+			self.__set__(obj, data)
+		obj._params[self.attr] = objects
 	
 	def __set_name__(self, owner, name):
 		"""Remember the name of the attribute.
@@ -178,8 +281,36 @@ class Committer(object):
 		instead of the ones from OSPRay.
 
 		"""
+		self.attr = name
 		self.name = Committer.normalize_name(name)
 	
+	def native_param(self, value):
+		"""Return the (kind, name, args) tuple :func:`ospSetParams` takes."""
+		args = value if isinstance(value, tuple) else (value,)
+		kind = self.kind
+		if kind is None:
+			kind = f'{len(args)}f'
+		elif kind in ('d', 'o'):
+			args = (value._ospray_object,)
+		return (kind, self.name, args)
+	
+	@staticmethod
+	def _same(old, new):
+		"""Return whether setting `new` over `old` would be a no-op."""
+		if isinstance(old, ManagedObject) or isinstance(new, ManagedObject):
+			return old is new
+		if type(old) is not type(new):
+			return False
+		try:
+			return bool(old == new)
+		except ValueError:
+			return False
+	
+	# Types that may also be set from a plain list of objects.
+	object_array_types = {
+		'OSPLight[]': OSP_LIGHT,
+	}
+	
 	@staticmethod
 	def normalize_name(name):
 		"""Map Pythonic attribute names to OSPRay names."""
@@ -195,9 +326,11 @@ class Committer(object):
 		
 		def setData(obj, name, value):
 			ospSetData(obj, name, value._ospray_object)
+		setData.kind = 'd'
 		
 		def setObject(obj, name, value):
 			ospSetObject(obj, name, value._ospray_object)
+		setObject.kind = 'o'
 			
 		if type == 'OSPCamera':
 			return setObject
@@ -261,6 +394,226 @@ class Committer(object):
 			return setData
 		else:
 			raise NotImplementedError
+	
+	@staticmethod
+	def get_ospray_kind(setter):
+		"""Return the kind of parameter a setter sets.
+		
+		This is the code :func:`ospSetParams` uses to pick the same
+		low-level setter, or None when it depends on the number of
+		values (as for ``'float / vec3f / vec4f'``).
+		
+		"""
+		kinds = {
+			ospSet1i: '1i',
+			ospSet1f: '1f',
+			ospSet2f: '2f',
+			ospSet3f: '3f',
+			ospSet3i: '3i',
+			ospSetString: 's',
+		}
+		return getattr(setter, 'kind', None) or kinds.get(setter)
+
+
+class ManagedObjectMeta(type):
+	"""Metaclass that indexes the Committers of each class.
+	
+	Every class gets a ``_committers`` dict mapping attribute names
+	to the :class:`~.Committer` descriptors it defines or inherits.
+	
+	"""
+	
+	def __init__(cls, name, bases, namespace):
+		super().__init__(name, bases, namespace)
+		committers = {}
+		for base in reversed(cls.__mro__):
+			for attr, value in vars(base).items():
+				if isinstance(value, Committer):
+					committers[attr] = value
+				elif attr in committers:
+					del committers[attr]
+		cls._committers = committers
+
+
+class ManagedObject(metaclass=ManagedObjectMeta):
+	"""Base class for all OSPRay objects
+	
+	Subclasses should override or extend the
+	:meth:`~.ManagedObject._make_ospray_object` method and return
+	an appropriate OSPRay object (e.g. `ospNewGeometry(...)`).
+
+	Any attributes that can be set (e.g. with `ospSet3f(...)` or
+	similar methods) can use the :class:`~.Committer` descriptor
+	in their class definition to automatically have getters/setters
+	with the appropriate types.
+	
+	Setting attributes marks the object dirty until its next commit,
+	which lets :func:`~.commit_dirty` commit only what changed. The
+	values set are remembered and can be read back as attributes or
+	all at once with :meth:`~.ManagedObject.parameters`; setting an
+	attribute to the value it already has does nothing.
+	
+	"""
+	
+	_dirty = True
+	_commit_with_children = False
+	_commit_serial = 0
+	_tracker = None
+	_tracker_record = None
+	_tracer = None
+	
+	@lazy_property
+	def _ospray_object(self):
+		"""Return the OSPRay object instance."""
+		tracer = ManagedObject._tracer
+		if tracer is not None:
+			start = tracer.now()
+		obj = self._make_ospray_object()
+		assert obj is not None
+		if tracer is not None:
+			tracer.created(start, self)
+		tracker = ManagedObject._tracker
+		if tracker is not None:
+			tracker._created_object(self, obj)
+		return obj
+	
+	@lazy_property
+	def _params(self):
+		"""Return the values set through Committers, keyed by attribute."""
+		return {}
+	
+	def parameters(self):
+		"""Return a dict of the attributes set on this object."""
+		return dict(self._params)
+	
+	def set(self, **params):
+		"""Set several attributes at once.
+		
+		See :meth:`~.ManagedObject.update`.
+		
+		"""
+		self.update(params)
+	
+	def update(self, params):
+		"""Set the attributes named by the keys of the `params` mapping.
+		
+		Every name is checked against the class's Committers before
+		anything is set, then the values that changed are passed to
+		OSPRay in a single call into the extension instead of one
+		call per attribute.
+		
+		"""
+		committers = self._committers
+		unknown = [attr for attr in params if attr not in committers]
+		if unknown:
+			raise AttributeError(f'{self.__class__.__name__} has no parameter(s) {", ".join(unknown)}')
+		
+		current = self._params
+		batch = []
+		changed = []
+		for attr, value in params.items():
+			committer = committers[attr]
+			if committer.type in Committer.object_array_types and not isinstance(value, ManagedObject):
+				committer.__set__(self, value)
+				continue
+			if attr in current and Committer._same(current[attr], value):
+				continue
+			batch.append(committer.native_param(value))
+			changed.append((committer, value))
+		
+		if not batch:
+			return
+		
+		ospray_object = self._ospray_object
+		tracer = ManagedObject._tracer
+		if tracer is not None:
+			start = tracer.now()
+		
+		# OSPRay applies the batch one item at a time, so a bad value
+		# can leave the ones before it set. Mark the object dirty
+		# first, and on failure forget the batch's remembered values
+		# (so setting them again isn't skipped) while still keeping
+		# any objects that may now be referenced by OSPRay alive.
+		self._dirty = True
+		try:
+			ospSetParams(ospray_object, batch)
+		except BaseException:
+			for committer, value in changed:
+				current.pop(committer.attr, None)
+				if isinstance(value, ManagedObject):
+					self._reference(committer.name, value)
+			raise
+		if tracer is not None:
+			tracer.complete(start, 'set', self.__class__.__name__, {'count': len(batch)})
+		for committer, value in changed:
+			current[committer.attr] = value
+			if isinstance(value, ManagedObject):
+				self._reference(committer.name, value)
+	
+	@lazy_property
+	def _references(self):
+		"""Return the objects set as parameters, keyed by name.
+		
+		Holding on to these keeps the Python side of everything
+		this object refers to alive for as long as this object is,
+		which is what keeps shared :class:`~.Data` buffers pinned.
+		
+		"""
+		return {}
+	
+	@lazy_property
+	def _stale_references(self):
+		"""Return replaced references that the next commit drops.
+		
+		OSPRay objects can keep using the previous value of a
+		parameter until they are committed again, so these are kept
+		alive until then.
+		
+		"""
+		return []
+	
+	def _children(self):
+		"""Return the objects this object refers to."""
+		return list(self._references.values())
+	
+	def _reference(self, key, value):
+		"""Remember that this object refers to `value` under `key`."""
+		old = self._references.get(key)
+		if old is not None and old is not value:
+			self._stale_references.append(old)
+		if value is None:
+			self._references.pop(key, None)
+		else:
+			self._references[key] = value
+	
+	def _make_ospray_object(self, *args, **kwargs):
+		"""Make the low-level OSPRay object and return it."""
+		raise NotImplementedError
+
+	def commit(self):
+		"""Commit any changes to OSPRay."""
+		ospray_object = self._ospray_object
+		tracer = ManagedObject._tracer
+		if tracer is not None:
+			start = tracer.now()
+		ospCommit(ospray_object)
+		if tracer is not None:
+			tracer.complete(start, 'commit', self.__class__.__name__)
+		self._stale_references.clear()
+		self._dirty = False
+		self._commit_serial = next(_commit_serials)
+	
+	def release(self):
+		ospray_object = self._ospray_object
+		tracer = ManagedObject._tracer
+		if tracer is not None:
+			start = tracer.now()
+		ospRelease(ospray_object)
+		if tracer is not None:
+			tracer.complete(start, 'release', self.__class__.__name__)
+		record = self._tracker_record
+		if record is not None:
+			record.tracker._released(record)
 
 
 class Volume(ManagedObject):
@@ -303,6 +656,52 @@ class StructuredVolume(Volume):
 	gridOrigin = Committer('vec3f')
 	gridSpacing = Committer('vec3f')
 	voxelData = Committer('OSPData')
+	
+	_voxel_types = {
+		'uint8': b'uchar',
+		'uint16': b'ushort',
+		'float32': b'float',
+		'float64': b'double',
+	}
+	
+	@classmethod
+	def from_raw(cls, path, dimensions, dtype, byteorder='=', offset=0):
+		"""Create a volume from a raw brick-of-values file.
+		
+		The file holds `dimensions` (x, y, z) values of `dtype`
+		stored with x varying fastest, starting `offset` bytes in
+		(e.g. to skip a header). It is memory-mapped read-only and
+		handed to OSPRay as a shared buffer, so pages are only read
+		as they are touched and every volume (in every process)
+		made from the same file shares them through the page cache.
+		
+		Files whose `byteorder` is not the native one can't be used
+		in place and are read into memory and swapped instead.
+		
+		The returned volume has its voxel data, dimensions and
+		voxel type set but still needs a transfer function and a
+		commit.
+		
+		"""
+		dtype = np.dtype(dtype).newbyteorder(byteorder)
+		try:
+			voxelType = cls._voxel_types[dtype.name]
+		except KeyError:
+			raise ValueError(f'unsupported voxel dtype {dtype}') from None
+		
+		x, y, z = dimensions
+		voxels = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(z, y, x))
+		if not voxels.dtype.isnative:
+			voxels = voxels.astype(dtype.newbyteorder('='))
+		
+		volume = cls()
+		type = Data._array_types[dtype.name][0]
+		with releasing(Data(type, voxels, Data.SHARED_BUFFER)) as data:
+			data.commit()
+			volume.voxelData = data
+		volume.dimensions = (x, y, z)
+		volume.voxelType = voxelType
+		return volume
 
 
 class AMRVolume(Volume):
@@ -377,6 +776,8 @@ class Geometry(ManagedObject):
 	
 	def add(self, material):
 		ospSetMaterial(self._ospray_object, material._ospray_object)
+		self._reference(b'material', material)
+		self._dirty = True
 	
 
 class TriangleMesh(Geometry):
@@ -515,12 +916,20 @@ class Instance(Geometry):
 	
 	"""
 	
+	_commit_with_children = True
+	
 	def __init__(self, model, transform):
+		"""Instance `model` (a :class:`~.Model`) with `transform`."""
 		self._model = model
 		self._transform = transform
+		if isinstance(model, ManagedObject):
+			self._reference(b'model', model)
 	
 	def _make_ospray_object(self):
-		return ospNewInstance(self._model, self._transform)
+		model = self._model
+		if isinstance(model, ManagedObject):
+			model = model._ospray_object
+		return ospNewInstance(model, self._transform)
 
 
 class Renderer(ManagedObject):
@@ -546,9 +955,89 @@ class Renderer(ManagedObject):
 	
 	def render(self, framebuffer, channels):
 		"""Render to the given framebuffer and return variance."""
+		tracer = ManagedObject._tracer
+		if tracer is not None:
+			start = tracer.now()
 		variance = ospRenderFrame(framebuffer._ospray_object, self._ospray_object, channels)
+		if tracer is not None:
+			tracer.complete(start, 'render', self.__class__.__name__)
 		return variance
 	
+	def render_submit(self, framebuffer, channels, timeout=None):
+		"""Render in the background and return a future of the variance.
+		
+		The frame is rendered by :func:`get_render_executor`. It can
+		be cancelled with the future's ``cancel()`` until it starts;
+		with a `timeout`, a frame that has not started within that
+		many seconds is skipped and its future raises
+		:class:`concurrent.futures.TimeoutError`. A frame that has
+		started always runs to completion.
+		
+		"""
+		deadline = None if timeout is None else time.monotonic() + timeout
+		return get_render_executor().submit(self._render_by, deadline, framebuffer, channels)
+	
+	async def render_async(self, framebuffer, channels, timeout=None):
+		"""Render without blocking the event loop and return variance.
+		
+		This awaits :meth:`render_submit`. Cancelling the awaiting
+		task, or running past `timeout` seconds (which raises
+		:class:`asyncio.TimeoutError`), cancels the frame if it has
+		not started yet.
+		
+		"""
+		future = asyncio.wrap_future(self.render_submit(framebuffer, channels, timeout))
+		if timeout is None:
+			return await future
+		return await asyncio.wait_for(future, timeout)
+	
+	def progressive(self, framebuffer, channels=None, variance_target=None, max_frames=None, time_limit=None):
+		"""Render successive refinements of one image.
+		
+		The framebuffer's accumulation buffer is cleared once and
+		every pass then adds to it, so each frame is a less noisy
+		version of the last. ``(frame, variance)`` is yielded after
+		each pass (counting from 1), which is the time to read the
+		image; ``variance`` is OSPRay's estimate of the remaining
+		error, which is only meaningful with :attr:`~.FrameBuffer.VARIANCE`.
+		
+		`channels` defaults to color, accumulation and variance,
+		which the framebuffer must have been created with. Refinement
+		stops once the variance is at or below `variance_target`
+		(which defaults to :attr:`varianceThreshold` if that was set),
+		after `max_frames` passes or once `time_limit` seconds have
+		passed, whichever comes first. Without any of them it goes on
+		until the caller stops iterating (e.g. when the camera moves).
+		
+		"""
+		if channels is None:
+			channels = FrameBuffer.COLOR | FrameBuffer.ACCUM | FrameBuffer.VARIANCE
+		if variance_target is None:
+			variance_target = self._params.get('varianceThreshold')
+		if not channels & FrameBuffer.VARIANCE:
+			variance_target = None
+		deadline = None if time_limit is None else time.monotonic() + time_limit
+		
+		framebuffer.clear(channels)
+		frame = 0
+		while True:
+			variance = self.render(framebuffer, channels)
+			frame += 1
+			yield frame, variance
+			
+			if max_frames is not None and frame >= max_frames:
+				return
+			if variance_target is not None and variance <= variance_target:
+				return
+			if deadline is not None and time.monotonic() >= deadline:
+				return
+	
+	def _render_by(self, deadline, framebuffer, channels):
+		"""Render unless `deadline` has passed."""
+		if deadline is not None and time.monotonic() > deadline:
+			raise concurrent.futures.TimeoutError('frame did not start before its timeout')
+		return self.render(framebuffer, channels)
+	
 	# TODO: Add ospPick support
 
 
@@ -591,6 +1080,8 @@ class Model(ManagedObject):
 	
 	"""
 	
+	_commit_with_children = True
+	
 	def _make_ospray_object(self):
 		return ospNewModel()
 	
@@ -605,6 +1096,10 @@ class Model(ManagedObject):
 			ospAddGeometry(self._ospray_object, obj._ospray_object)
 		elif isinstance(obj, Volume):
 			ospAddVolume(self._ospray_object, obj._ospray_object)
+		else:
+			return
+		self._reference(id(obj), obj)
+		self._dirty = True
 
 	def remove(self, obj):
 		"""Remove an object from the model.
@@ -617,6 +1112,10 @@ class Model(ManagedObject):
 			ospRemoveGeometry(self._ospray_object, obj._ospray_object)
 		elif isinstance(obj, Volume):
 			ospRemoveVolume(self._ospray_object, obj._ospray_object)
+		else:
+			return
+		self._reference(id(obj), None)
+		self._dirty = True
 	
 
 class Light(ManagedObject):
@@ -1051,6 +1550,14 @@ class FrameBuffer(ManagedObject):
 	NORMAL = OSP_FB_NORMAL
 	ALBEDO = OSP_FB_ALBEDO
 
+	_pixel_channels = {
+		b'rgb': 3,
+		b'rgba': 4,
+		b'bgr': 3,
+		b'bgra': 4,
+		b'gray': 1,
+	}
+
 	def __init__(self, size, format, channels):
 		self._size = size
 		self._format = format
@@ -1065,7 +1572,79 @@ class FrameBuffer(ManagedObject):
 	def clear(self, channels):
 		ospFrameBufferClear(self._ospray_object, channels)
 	
-	# TODO: Add map, unmap, and pixel op
+	@contextmanager
+	def map(self, channel=COLOR):
+		"""Map a channel as a NumPy array for the duration of the block.
+		
+		The array is a read-only view of OSPRay's own memory, so
+		no pixels are copied. Its shape and dtype depend on the
+		channel:
+		
+		* :attr:`COLOR`: ``(height, width, 4)`` uint8, or float32
+		  for :attr:`RGBA32F` framebuffers
+		* :attr:`DEPTH` and :attr:`VARIANCE`: ``(height, width)``
+		  float32
+		* :attr:`NORMAL` and :attr:`ALBEDO`: ``(height, width, 3)``
+		  float32
+		* :attr:`ACCUM`: ``(height, width, 4)`` float32
+		
+		Like OSPRay, the first row is the bottom of the image; use
+		``array[::-1]`` for a top-down view. The channel is unmapped
+		when the block exits, after which the array must not be used
+		(copy it to keep the pixels). Which channels can be mapped
+		depends on the OSPRay version and device.
+		
+		"""
+		dtype, shape = self._channel_layout(channel)
+		array = ospMapFrameBufferArray(self._ospray_object, channel, dtype, shape)
+		try:
+			yield array
+		finally:
+			ospUnmapFrameBufferArray(array)
+	
+	def read_pixels(self, out=None, format='rgb', flip=True):
+		"""Read the color channel into `out` and return it.
+		
+		`out` can be any writable, C-contiguous buffer (a
+		bytearray, an ndarray, shared memory, ...) of at least
+		``width * height`` times the number of channels in `format`
+		bytes, so a single buffer can be reused for every frame. A
+		new bytearray is made when it is None.
+		
+		`format` is one of ``'rgb'``, ``'rgba'``, ``'bgr'``,
+		``'bgra'`` or ``'gray'``; :attr:`RGBA32F` framebuffers are
+		converted to 8 bits per channel. With `flip`, the first row
+		of `out` is the top of the image.
+		
+		The conversion runs without holding the GIL.
+		
+		"""
+		if isinstance(format, str):
+			format = format.encode('ascii')
+		if format not in FrameBuffer._pixel_channels:
+			raise ValueError(f'unknown pixel format {format!r}')
+		if out is None:
+			out = bytearray(self._size.x * self._size.y * FrameBuffer._pixel_channels[format])
+		ospReadPixels(self._ospray_object, self._size, self._format, format, flip, out)
+		return out
+	
+	def _channel_layout(self, channel):
+		"""Return the dtype and shape of a mapped channel."""
+		height, width = self._size.y, self._size.x
+		if channel == FrameBuffer.COLOR:
+			if self._format == FrameBuffer.RGBA32F:
+				return 'float32', (height, width, 4)
+			return 'uint8', (height, width, 4)
+		elif channel in (FrameBuffer.DEPTH, FrameBuffer.VARIANCE):
+			return 'float32', (height, width)
+		elif channel in (FrameBuffer.NORMAL, FrameBuffer.ALBEDO):
+			return 'float32', (height, width, 3)
+		elif channel == FrameBuffer.ACCUM:
+			return 'float32', (height, width, 4)
+		else:
+			raise ValueError(f'cannot map framebuffer channel {channel!r}')
+	
+	# TODO: Add pixel op
 
 
 class PixelOp(ManagedObject):
@@ -1100,6 +1679,17 @@ class ToneMapper(PixelOp):
 class Data(ManagedObject):
 	"""See `the documentation`__.
 	
+	With the :attr:`SHARED_BUFFER` flag, OSPRay reads from the
+	array's memory instead of copying it. The array is then pinned
+	for as long as this object is alive, and this object is kept
+	alive by every object it is set on (and those by their own
+	parents, e.g. a model holding a volume), so it is safe to
+	:meth:`~.ManagedObject.release` it right after setting it::
+	
+	  with releasing(Data.from_array(voxels, Data.SHARED_BUFFER)) as data:
+	      data.commit()
+	      volume.voxelData = data
+	
 	__ https://www.ospray.org/documentation.html#data
 	
 	"""
@@ -1152,13 +1742,116 @@ class Data(ManagedObject):
 	NONE = 0
 	SHARED_BUFFER = OSP_DATA_SHARED_BUFFER
 	
+	# Types indexed by the number of components per item, keyed by
+	# the NumPy dtype name that backs them.
+	_array_types = {
+		'int8': (CHAR,),
+		'uint8': (UCHAR, UCHAR2, UCHAR3, UCHAR4),
+		'uint16': (USHORT,),
+		'int32': (INT, INT2, INT3, INT4),
+		'uint32': (UINT, UINT2, UINT3, UINT4),
+		'int64': (LONG, LONG2, LONG3, LONG4),
+		'uint64': (ULONG, ULONG2, ULONG3, ULONG4),
+		'float32': (FLOAT, FLOAT2, FLOAT3, FLOAT4),
+		'float64': (DOUBLE,),
+	}
+	
+	_pinned_lock = threading.Lock()
+	_pinned_total = 0
+	
+	# Types whose items are other objects, given as a sequence of
+	# them rather than an array.
+	_object_types = frozenset({
+		OBJECT, CAMERA, DATA, FRAMEBUFFER, GEOMETRY, LIGHT, MATERIAL,
+		MODEL, RENDERER, TEXTURE, TRANSFER_FUNCTION, VOLUME, PIXEL_OP,
+	})
+	
 	def __init__(self, type, data, flags):
+		if type in Data._object_types:
+			if flags & Data.SHARED_BUFFER:
+				raise ValueError('object data cannot use a shared buffer')
+			data = list(data)
+		
 		self._type = type
 		self._data = data
 		self._flags = flags
+		
+		if flags & Data.SHARED_BUFFER:
+			Data._pin(self.pinned_bytes)
+			weakref.finalize(self, Data._pin, -self.pinned_bytes)
 	
 	def _make_ospray_object(self):
 		return ospNewData((self._type, self._data), self._flags)
+	
+	def _children(self):
+		"""Return the objects this object refers to, including its items."""
+		children = super()._children()
+		if self._type in Data._object_types:
+			children.extend(self._data)
+		return children
+	
+	def _holds(self, objects):
+		"""Return whether this is object data of exactly `objects`."""
+		if self._type not in Data._object_types or len(self._data) != len(objects):
+			return False
+		return all(a is b for a, b in zip(self._data, objects))
+	
+	@property
+	def pinned_bytes(self):
+		"""Return the bytes of the shared buffer this object pins."""
+		if not self._flags & Data.SHARED_BUFFER:
+			return 0
+		return memoryview(self._data).nbytes
+	
+	@classmethod
+	def total_pinned_bytes(cls):
+		"""Return the bytes pinned by all live shared buffers."""
+		with cls._pinned_lock:
+			return Data._pinned_total
+	
+	@staticmethod
+	def _pin(nbytes):
+		"""Add `nbytes` to the pinned byte count."""
+		with Data._pinned_lock:
+			Data._pinned_total += nbytes
+	
+	@classmethod
+	def from_array(cls, array, flags=NONE):
+		"""Create data from an array, inferring its type.
+		
+		The array may have any number of dimensions but must be
+		C-contiguous and in native byte order; it is handed to
+		OSPRay as is, without being flattened or converted. See
+		:meth:`~.Data.infer_type` for how the type is chosen.
+		
+		"""
+		return cls(cls.infer_type(array), array, flags)
+	
+	@classmethod
+	def infer_type(cls, array):
+		"""Return the OSPDataType matching a NumPy array.
+		
+		The element type comes from the array's dtype. When the
+		array has more than one dimension and its last axis has 2,
+		3 or 4 entries, that axis is taken to hold the components
+		of a vector type (e.g. a ``(N, 3)`` float32 array is
+		:attr:`FLOAT3`), otherwise every element is one item (e.g.
+		a ``(Z, Y, X)`` uint8 volume is :attr:`UCHAR`).
+		
+		Pass the type explicitly to :class:`~.Data` where this is
+		ambiguous, such as for :attr:`FLOAT3A`.
+		
+		"""
+		try:
+			types = cls._array_types[array.dtype.name]
+		except KeyError:
+			raise TypeError(f'no OSPDataType for dtype {array.dtype}') from None
+		
+		components = 1
+		if array.ndim > 1 and 2 <= array.shape[-1] <= len(types):
+			components = array.shape[-1]
+		
+		return types[components - 1]
 
 
 class _Builtin:
@@ -1186,3 +1879,12 @@ class _Builtin:
 
 
 builtin = _Builtin()
+
+
+from .snapshot import *
+from .cache import *
+from .tracker import *
+from .pool import *
+from .tiles import *
+from .batch import *
+from .tracing import *
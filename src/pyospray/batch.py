@@ -0,0 +1,123 @@
+"""
+Render many camera poses of one scene
+
+Rendering a camera path one frame at a time from Python costs a new
+image buffer and a conversion per frame. :func:`render_batch` instead
+reuses a single framebuffer and reads every frame straight into one
+preallocated ``(N, height, width, channels)`` array, while
+:func:`iter_render_batch` streams the frames through one reused buffer.
+
+"""
+
+from . import FrameBuffer, commit_dirty
+import numpy as np
+import time
+
+
+__all__ = [
+	'render_batch', 'iter_render_batch', 'batch_timing_dtype',
+]
+
+
+batch_timing_dtype = np.dtype([
+	('commit', 'float64'),
+	('render', 'float64'),
+	('read', 'float64'),
+])
+
+
+def render_batch(renderer, camera, poses, framebuffer, out=None, format='rgb', channels=FrameBuffer.COLOR):
+	"""Render every pose in `poses` and return ``(frames, timings)``.
+	
+	`poses` is either an ``(N, 9)`` array of ``pos``, ``dir`` and
+	``up`` vectors, or an ``(N, 4, 4)`` array of camera-to-world
+	matrices (the camera looking down its negative z axis, with y
+	up). `camera` must be the renderer's camera; it is moved to each
+	pose in turn and rendered into `framebuffer`.
+	
+	`frames` is `out`, which must be a C-contiguous uint8 array of
+	shape ``(N, height, width, channels)`` for the number of
+	channels in `format` (see :meth:`~.FrameBuffer.read_pixels`),
+	or a new one when `out` is None. `timings` is an array of
+	:data:`batch_timing_dtype` with the seconds each frame spent
+	committing the camera, rendering and reading pixels.
+	
+	"""
+	positions, directions, ups = _split_poses(poses)
+	
+	if isinstance(format, str):
+		format = format.encode('ascii')
+	shape = (len(positions), framebuffer._size.y, framebuffer._size.x, FrameBuffer._pixel_channels[format])
+	if out is None:
+		out = np.empty(shape, dtype='uint8')
+	elif out.shape != shape or out.dtype != np.uint8 or not out.flags.c_contiguous:
+		raise ValueError(f'out must be a C-contiguous uint8 array of shape {shape}')
+	
+	timings = np.zeros(len(positions), dtype=batch_timing_dtype)
+	frames = _render_poses(renderer, camera, positions, directions, ups, framebuffer, format, channels, out, timings)
+	for _ in frames:
+		pass
+	
+	return out, timings
+
+
+def iter_render_batch(renderer, camera, poses, framebuffer, format='rgb', channels=FrameBuffer.COLOR):
+	"""Render every pose in `poses`, yielding ``(index, frame, timing)``.
+	
+	This is the streaming counterpart to :func:`render_batch`, which
+	describes the arguments. `frame` is a ``(height, width,
+	channels)`` uint8 array that is reused for every frame, so it
+	must be consumed (encoded, written or copied) before asking for
+	the next one. `timing` is a :data:`batch_timing_dtype` record.
+	
+	"""
+	positions, directions, ups = _split_poses(poses)
+	
+	if isinstance(format, str):
+		format = format.encode('ascii')
+	shape = (1, framebuffer._size.y, framebuffer._size.x, FrameBuffer._pixel_channels[format])
+	out = np.empty(shape, dtype='uint8')
+	timings = np.zeros(len(positions), dtype=batch_timing_dtype)
+	
+	frames = _render_poses(renderer, camera, positions, directions, ups, framebuffer, format, channels, out, timings)
+	for index in frames:
+		yield index, out[0], timings[index]
+
+
+def _render_poses(renderer, camera, positions, directions, ups, framebuffer, format, channels, out, timings):
+	"""Render each pose into `out`, yielding the index of each frame.
+	
+	With a single-frame `out`, every frame is read into it.
+	
+	"""
+	commit_dirty(renderer)
+	
+	for index in range(len(positions)):
+		start = time.perf_counter()
+		camera.pos = tuple(positions[index].tolist())
+		camera.dir = tuple(directions[index].tolist())
+		camera.up = tuple(ups[index].tolist())
+		if camera._dirty:
+			camera.commit()
+		committed = time.perf_counter()
+		
+		framebuffer.clear(channels)
+		renderer.render(framebuffer, channels)
+		rendered = time.perf_counter()
+		
+		framebuffer.read_pixels(out[index % len(out)], format)
+		read = time.perf_counter()
+		
+		timings[index] = (committed - start, rendered - committed, read - rendered)
+		yield index
+
+
+def _split_poses(poses):
+	"""Return the positions, directions and up vectors of `poses`."""
+	poses = np.asarray(poses, dtype='float64')
+	if poses.ndim == 2 and poses.shape[1] == 9:
+		return poses[:, 0:3], poses[:, 3:6], poses[:, 6:9]
+	elif poses.ndim == 3 and poses.shape[1:] == (4, 4):
+		return poses[:, :3, 3], -poses[:, :3, 2], poses[:, :3, 1]
+	else:
+		raise ValueError(f'poses must have shape (N, 9) or (N, 4, 4), not {poses.shape}')
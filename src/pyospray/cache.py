@@ -0,0 +1,174 @@
+"""
+Deduplicate uploads of identical arrays
+
+A :class:`DataCache` sits in front of :class:`~.Data`: asking it for
+data of an array that has already been uploaded (the same array, or any
+array with the same contents, type and flags) returns the existing
+object instead of uploading a second copy.
+
+"""
+
+from . import Data
+from collections import OrderedDict
+from contextlib import contextmanager
+import hashlib
+import threading
+
+
+__all__ = [
+	'DataCache',
+]
+
+
+class _Entry:
+	"""A cached Data and the number of users holding it."""
+	
+	__slots__ = ('key', 'fast_key', 'data', 'nbytes', 'refs')
+	
+	def __init__(self, key, fast_key, data, nbytes):
+		self.key = key
+		self.fast_key = fast_key
+		self.data = data
+		self.nbytes = nbytes
+		self.refs = 0
+
+
+class DataCache:
+	"""Content-addressed cache of :class:`~.Data` objects.
+	
+	Intended to be used like::
+	
+	  cache = DataCache(max_bytes=2**30)
+	  data = cache.acquire(Data.FLOAT3, colors)
+	  transferFunction.colors = data
+	  cache.release(data)
+	
+	Arrays are identified by a hash of their contents. Asking again
+	for the very same array object skips hashing entirely, so cached
+	arrays must not be modified in place.
+	
+	Every :meth:`~.DataCache.acquire` takes a reference that
+	:meth:`~.DataCache.release` gives back (do not call
+	:meth:`~.ManagedObject.release` on cached data). Entries without
+	references stay cached for reuse until the total size of the
+	cache exceeds `max_bytes`, at which point the least recently used
+	of them are released. Objects the data was set on keep it alive
+	on their own, so evicting it never pulls it out from under them.
+	
+	"""
+	
+	def __init__(self, max_bytes):
+		self.max_bytes = max_bytes
+		self.nbytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._lock = threading.RLock()
+		self._entries = OrderedDict()
+		self._by_buffer = {}
+		self._by_data = {}
+	
+	def acquire(self, type, array, flags=Data.NONE):
+		"""Return committed data of `array`, sharing identical uploads."""
+		view = memoryview(array)
+		if not view.c_contiguous:
+			raise ValueError('cached arrays must be C-contiguous')
+		
+		interface = array.__array_interface__
+		fast_key = (interface['data'][0], interface['typestr'], interface['shape'], type, flags)
+		
+		with self._lock:
+			entry = self._by_buffer.get(fast_key)
+			if entry is not None:
+				return self._hit(entry)
+		
+		digest = hashlib.blake2b(view.cast('B'), digest_size=16).digest()
+		key = (digest, interface['typestr'], interface['shape'], type, flags)
+		
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None:
+				return self._hit(entry)
+			
+			self.misses += 1
+			data = Data(type, array, flags)
+			data.commit()
+			
+			# The entry keeps `array` alive through `data`, so its
+			# address can't be reused by another array while the fast
+			# path refers to it.
+			entry = _Entry(key, fast_key, data, view.nbytes)
+			self._entries[key] = entry
+			self._by_buffer[fast_key] = entry
+			self._by_data[id(data)] = entry
+			self.nbytes += entry.nbytes
+			entry.refs += 1
+			self._evict()
+			return data
+	
+	def release(self, data):
+		"""Give back a reference taken by :meth:`~.DataCache.acquire`."""
+		with self._lock:
+			entry = self._by_data[id(data)]
+			if entry.refs <= 0:
+				raise ValueError('data released more often than it was acquired')
+			entry.refs -= 1
+			self._evict()
+	
+	@contextmanager
+	def acquiring(self, type, array, flags=Data.NONE):
+		"""Acquire data for the duration of the block.
+		
+		This is the cached counterpart to :func:`~.releasing`.
+		
+		"""
+		data = self.acquire(type, array, flags)
+		try:
+			yield data
+		finally:
+			self.release(data)
+	
+	def clear(self):
+		"""Release every entry that is not in use."""
+		with self._lock:
+			for entry in list(self._entries.values()):
+				if entry.refs == 0:
+					self._remove(entry)
+	
+	def stats(self):
+		"""Return a dict of the cache's size and hit counts."""
+		with self._lock:
+			return {
+				'entries': len(self._entries),
+				'bytes': self.nbytes,
+				'max_bytes': self.max_bytes,
+				'hits': self.hits,
+				'misses': self.misses,
+				'evictions': self.evictions,
+			}
+	
+	def _hit(self, entry):
+		"""Take a reference to a cached entry and return its data."""
+		self.hits += 1
+		entry.refs += 1
+		self._entries.move_to_end(entry.key)
+		return entry.data
+	
+	def _evict(self):
+		"""Release unused entries, oldest first, until within budget."""
+		if self.nbytes <= self.max_bytes:
+			return
+		for entry in list(self._entries.values()):
+			if self.nbytes <= self.max_bytes:
+				break
+			if entry.refs == 0:
+				self._remove(entry)
+				self.evictions += 1
+	
+	def _remove(self, entry):
+		"""Drop an entry and release its data."""
+		del self._entries[entry.key]
+		del self._by_buffer[entry.fast_key]
+		del self._by_data[id(entry.data)]
+		self.nbytes -= entry.nbytes
+		entry.data.release()
@@ -0,0 +1,403 @@
+"""
+Pool the per-request state needed to render
+
+Rendering one image needs a camera, a renderer and a framebuffer of its
+own, but the (usually much larger) model behind them can be shared. A
+:class:`RenderContextPool` keeps a set of those contexts warm and hands
+them out to threads or asyncio tasks, growing on demand up to a maximum
+and shrinking again when they sit idle.
+
+"""
+
+from . import Camera, Renderer, FrameBuffer, commit_dirty
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+import weakref
+
+
+__all__ = [
+	'RenderContext', 'RenderContextPool', 'PoolTimeout',
+]
+
+
+class PoolTimeout(TimeoutError):
+	"""No render context became available in time."""
+
+
+# Handed to a waiter instead of a context when a slot frees up, telling
+# it to make the context itself.
+_CREATE = object()
+
+
+@dataclass
+class RenderContext:
+	"""The objects one render needs to itself.
+	
+	`pixels` is an optional scratch buffer for
+	:meth:`~.FrameBuffer.read_pixels` that is reused along with the
+	context.
+	
+	"""
+	
+	camera: Camera
+	renderer: Renderer
+	framebuffer: FrameBuffer
+	pixels: bytearray = None
+	
+	@property
+	def size(self):
+		"""Return the framebuffer's size."""
+		return self.framebuffer._size
+	
+	def render(self, channels=FrameBuffer.COLOR, on_commit=None):
+		"""Commit what changed, clear the framebuffer and render.
+		
+		`on_commit` is passed on to :func:`~.commit_dirty`.
+		
+		"""
+		commit_dirty(self.renderer, on_commit=on_commit)
+		self.framebuffer.clear(channels)
+		return self.renderer.render(self.framebuffer, channels)
+	
+	def release(self):
+		"""Release the context's own objects (but not the model)."""
+		self.framebuffer.release()
+		self.renderer.release()
+		self.camera.release()
+
+
+def warm_up(context):
+	"""Render one frame so the first real request doesn't pay for it."""
+	context.render()
+
+
+class RenderContextPool:
+	"""A pool of :class:`~.RenderContext` objects.
+	
+	Intended to be used like::
+	
+	  pool = RenderContextPool(partial(make_context, model), min_size=2, max_size=8)
+	  with pool.acquiring(timeout=1.0) as context:
+	      context.camera.pos = pos
+	      context.render()
+	
+	`factory` is called (with no arguments) whenever the pool grows,
+	and `warmup` (if not None) is then called with the new context.
+	The pool starts with `min_size` contexts and grows on demand up
+	to `max_size`. Contexts above `min_size` that have been idle for
+	`idle_timeout` seconds are released when a context is returned
+	or :meth:`~.RenderContextPool.shrink` is called. Waiters are
+	served in the order they arrived.
+	
+	After a fork, the child keeps the idle contexts it inherited and
+	forgets those that were in use by the parent's other threads.
+	
+	"""
+	
+	def __init__(self, factory, min_size=1, max_size=4, idle_timeout=None, warmup=warm_up):
+		if not 0 <= min_size <= max_size:
+			raise ValueError('need 0 <= min_size <= max_size')
+		
+		self.factory = factory
+		self.min_size = min_size
+		self.max_size = max_size
+		self.idle_timeout = idle_timeout
+		self.warmup = warmup
+		
+		self._lock = threading.Lock()
+		self._idle = []
+		self._waiters = deque()
+		self._size = 0
+		self._in_use = 0
+		self._created = 0
+		self._destroyed = 0
+		self._acquired = 0
+		self._timeouts = 0
+		self._wait_total = 0.0
+		self._wait_max = 0.0
+		
+		if hasattr(os, 'register_at_fork'):
+			ref = weakref.ref(self)
+			os.register_at_fork(after_in_child=lambda: ref() is not None and ref()._after_fork())
+		
+		contexts = []
+		for _ in range(min_size):
+			with self._lock:
+				self._size += 1
+				self._in_use += 1
+			contexts.append(self._create())
+		for context in contexts:
+			self.release(context)
+	
+	def acquire(self, timeout=None):
+		"""Return a context, waiting at most `timeout` seconds.
+		
+		Raises :class:`~.PoolTimeout` when none became available.
+		Every context acquired must be given back with
+		:meth:`~.RenderContextPool.release`.
+		
+		"""
+		start = time.monotonic()
+		context, waiter = self._request()
+		if waiter is not None:
+			try:
+				context = waiter.result(timeout)
+			except concurrent.futures.TimeoutError:
+				if waiter.cancel():
+					self._timed_out()
+				context = waiter.result()
+			if context is _CREATE:
+				context = self._create()
+		elif context is None:
+			context = self._create()
+		self._waited(time.monotonic() - start)
+		return context
+	
+	def try_acquire(self, keep_idle=0):
+		"""Return an idle context, or None if there is none.
+		
+		Unlike :meth:`~.RenderContextPool.acquire`, this never waits
+		or grows the pool, which suits optional work like rendering
+		ahead of requests. It also returns None while anyone is
+		waiting for a context or when taking one would leave fewer
+		than `keep_idle` idle for them.
+		
+		"""
+		with self._lock:
+			if len(self._idle) <= keep_idle:
+				return None
+			if any(not waiter.cancelled() for waiter in self._waiters):
+				return None
+			context, _ = self._idle.pop()
+			self._in_use += 1
+		self._waited(0.0)
+		return context
+	
+	async def acquire_async(self, timeout=None):
+		"""Return a context without blocking the event loop.
+		
+		This is the asyncio counterpart to
+		:meth:`~.RenderContextPool.acquire`. New contexts are made in
+		the loop's default executor.
+		
+		"""
+		start = time.monotonic()
+		context, waiter = self._request()
+		if waiter is not None:
+			future = asyncio.wrap_future(waiter)
+			try:
+				done, _ = await asyncio.wait({future}, timeout=timeout)
+				if not done and waiter.cancel():
+					self._timed_out()
+				context = await future
+			except asyncio.CancelledError:
+				if not waiter.cancel():
+					waiter.add_done_callback(lambda waiter: self._give_back(waiter.result()))
+				raise
+			if context is _CREATE:
+				context = await self._create_async()
+		elif context is None:
+			context = await self._create_async()
+		self._waited(time.monotonic() - start)
+		return context
+	
+	def release(self, context):
+		"""Give a context back to the pool."""
+		with self._lock:
+			waiter = self._next_waiter()
+			if waiter is None:
+				self._in_use -= 1
+				self._idle.append((context, time.monotonic()))
+				expired = self._expire()
+		
+		# Results are set outside the lock, since setting one runs the
+		# future's callbacks, which may come back into the pool.
+		if waiter is not None:
+			waiter.set_result(context)
+			return
+		self._destroy(expired)
+	
+	def discard(self, context):
+		"""Release a context that is broken instead of pooling it."""
+		self._free_slot()
+		self._destroy([context])
+	
+	@contextmanager
+	def acquiring(self, timeout=None):
+		"""Acquire a context for the duration of the block."""
+		context = self.acquire(timeout)
+		try:
+			yield context
+		finally:
+			self.release(context)
+	
+	def shrink(self):
+		"""Release contexts that have been idle for too long."""
+		with self._lock:
+			expired = self._expire()
+		self._destroy(expired)
+	
+	def stats(self):
+		"""Return a dict describing the pool's size and waits."""
+		with self._lock:
+			return {
+				'size': self._size,
+				'min_size': self.min_size,
+				'max_size': self.max_size,
+				'idle': len(self._idle),
+				'in_use': self._in_use,
+				'waiting': sum(1 for waiter in self._waiters if not waiter.cancelled()),
+				'occupancy': self._in_use / self.max_size if self.max_size else 0.0,
+				'created': self._created,
+				'destroyed': self._destroyed,
+				'acquired': self._acquired,
+				'timeouts': self._timeouts,
+				'wait_seconds_total': self._wait_total,
+				'wait_seconds_max': self._wait_max,
+			}
+	
+	def close(self):
+		"""Release every idle context."""
+		with self._lock:
+			expired = [context for context, _ in self._idle]
+			self._size -= len(expired)
+			self._idle.clear()
+		self._destroy(expired)
+	
+	def _request(self):
+		"""Take an idle context, room for a new one, or a place in line.
+		
+		Returns ``(context, None)`` for an idle context, ``(None,
+		None)`` when the caller should make a new one and ``(None,
+		waiter)`` when it has to wait on the `waiter` future.
+		
+		"""
+		with self._lock:
+			if self._idle:
+				context, _ = self._idle.pop()
+				self._in_use += 1
+				return context, None
+			if self._size < self.max_size:
+				self._size += 1
+				self._in_use += 1
+				return None, None
+			waiter = concurrent.futures.Future()
+			self._waiters.append(waiter)
+			return None, waiter
+	
+	def _next_waiter(self):
+		"""Remove and return the first waiter still waiting, if any.
+		
+		Must be called with the lock held.
+		
+		"""
+		while self._waiters:
+			waiter = self._waiters.popleft()
+			if waiter.set_running_or_notify_cancel():
+				return waiter
+		return None
+	
+	def _free_slot(self):
+		"""Give up an in-use slot that has no context.
+		
+		The first waiter, if there is one, gets the slot to make a
+		context in instead, so it isn't left waiting on a pool that
+		has room.
+		
+		"""
+		with self._lock:
+			waiter = self._next_waiter()
+			if waiter is None:
+				self._size -= 1
+				self._in_use -= 1
+		if waiter is not None:
+			waiter.set_result(_CREATE)
+	
+	def _give_back(self, context):
+		"""Return what a waiter that gave up was handed."""
+		if context is _CREATE:
+			self._free_slot()
+		else:
+			self.release(context)
+	
+	def _create(self):
+		"""Make a new context for a slot that was already counted."""
+		try:
+			context = self.factory()
+			if self.warmup is not None:
+				self.warmup(context)
+		except BaseException:
+			self._free_slot()
+			raise
+		with self._lock:
+			self._created += 1
+		return context
+	
+	async def _create_async(self):
+		"""Make a new context in the event loop's default executor.
+		
+		If the caller is cancelled meanwhile, the context is given
+		back once it is made (a failed
+		:meth:`~.RenderContextPool._create` frees its slot itself).
+		
+		"""
+		future = asyncio.get_event_loop().run_in_executor(None, self._create)
+		try:
+			return await asyncio.shield(future)
+		except asyncio.CancelledError:
+			future.add_done_callback(self._created_for_cancelled)
+			raise
+	
+	def _created_for_cancelled(self, future):
+		"""Give back the context made for a cancelled acquire."""
+		if not future.cancelled() and future.exception() is None:
+			self.release(future.result())
+	
+	def _expire(self):
+		"""Remove and return the idle contexts past their timeout.
+		
+		Must be called with the lock held.
+		
+		"""
+		if self.idle_timeout is None:
+			return []
+		deadline = time.monotonic() - self.idle_timeout
+		expired = []
+		while self._idle and self._size > self.min_size and self._idle[0][1] < deadline:
+			context, _ = self._idle.pop(0)
+			self._size -= 1
+			expired.append(context)
+		return expired
+	
+	def _destroy(self, contexts):
+		"""Release contexts that have left the pool."""
+		for context in contexts:
+			context.release()
+		with self._lock:
+			self._destroyed += len(contexts)
+	
+	def _waited(self, seconds):
+		"""Record how long an acquire took."""
+		with self._lock:
+			self._acquired += 1
+			self._wait_total += seconds
+			self._wait_max = max(self._wait_max, seconds)
+	
+	def _timed_out(self):
+		"""Count and raise a timed out acquire."""
+		with self._lock:
+			self._timeouts += 1
+		raise PoolTimeout('no render context became available in time')
+	
+	def _after_fork(self):
+		"""Reset the state that doesn't survive into a forked child."""
+		self._lock = threading.Lock()
+		self._waiters = deque()
+		self._size = len(self._idle)
+		self._in_use = 0
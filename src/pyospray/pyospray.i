@@ -18,7 +18,7 @@ import_array();
     int i;
     $1 = malloc(sizeof(int));
     *$1 = PyList_Size($input);
-    $2 = (char **) malloc(*($1+1)*sizeof(char *));
+    $2 = (char **) malloc((*$1 + 1)*sizeof(char *));
     for (i = 0; i < *$1; i++) {
       PyObject *o = PyList_GetItem($input, i);
       if (PyString_Check(o)) {
@@ -50,12 +50,76 @@ import_array();
 	$1 = (int32_t)PyInt_AsLong($input);
 }
 
-%typemap(in, fragment="NumPy_Fragments") (size_t numItems, OSPDataType, const void *source) {
-	PyObject *pyType, *pySource, *pyObj;
-	SwigPyObject *swigObj;
+%{
+/* Map an OSPDataType onto the NumPy element type backing it and the
+ * number of elements that make up one item of that type. Returns 0 for
+ * types that cannot be created from an array. */
+static int
+pyospray_data_spec(OSPDataType type, int *npyType, int *components) {
+  switch (type) {
+  case OSP_CHAR:    *npyType = NPY_INT8;    *components = 1; break;
+  case OSP_UCHAR:   *npyType = NPY_UINT8;   *components = 1; break;
+  case OSP_UCHAR2:  *npyType = NPY_UINT8;   *components = 2; break;
+  case OSP_UCHAR3:  *npyType = NPY_UINT8;   *components = 3; break;
+  case OSP_UCHAR4:  *npyType = NPY_UINT8;   *components = 4; break;
+  case OSP_USHORT:  *npyType = NPY_UINT16;  *components = 1; break;
+  case OSP_INT:     *npyType = NPY_INT32;   *components = 1; break;
+  case OSP_INT2:    *npyType = NPY_INT32;   *components = 2; break;
+  case OSP_INT3:    *npyType = NPY_INT32;   *components = 3; break;
+  case OSP_INT4:    *npyType = NPY_INT32;   *components = 4; break;
+  case OSP_UINT:    *npyType = NPY_UINT32;  *components = 1; break;
+  case OSP_UINT2:   *npyType = NPY_UINT32;  *components = 2; break;
+  case OSP_UINT3:   *npyType = NPY_UINT32;  *components = 3; break;
+  case OSP_UINT4:   *npyType = NPY_UINT32;  *components = 4; break;
+  case OSP_LONG:    *npyType = NPY_INT64;   *components = 1; break;
+  case OSP_LONG2:   *npyType = NPY_INT64;   *components = 2; break;
+  case OSP_LONG3:   *npyType = NPY_INT64;   *components = 3; break;
+  case OSP_LONG4:   *npyType = NPY_INT64;   *components = 4; break;
+  case OSP_ULONG:   *npyType = NPY_UINT64;  *components = 1; break;
+  case OSP_ULONG2:  *npyType = NPY_UINT64;  *components = 2; break;
+  case OSP_ULONG3:  *npyType = NPY_UINT64;  *components = 3; break;
+  case OSP_ULONG4:  *npyType = NPY_UINT64;  *components = 4; break;
+  case OSP_FLOAT:   *npyType = NPY_FLOAT32; *components = 1; break;
+  case OSP_FLOAT2:  *npyType = NPY_FLOAT32; *components = 2; break;
+  case OSP_FLOAT3:  *npyType = NPY_FLOAT32; *components = 3; break;
+  case OSP_FLOAT4:  *npyType = NPY_FLOAT32; *components = 4; break;
+  case OSP_FLOAT3A: *npyType = NPY_FLOAT32; *components = 4; break;
+  case OSP_DOUBLE:  *npyType = NPY_FLOAT64; *components = 1; break;
+  default:
+    return 0;
+  }
+  return 1;
+}
+
+/* Whether data of this type is an array of object handles. */
+static int
+pyospray_is_object_type(OSPDataType type) {
+  switch (type) {
+  case OSP_OBJECT:
+  case OSP_CAMERA:
+  case OSP_DATA:
+  case OSP_FRAMEBUFFER:
+  case OSP_GEOMETRY:
+  case OSP_LIGHT:
+  case OSP_MATERIAL:
+  case OSP_MODEL:
+  case OSP_RENDERER:
+  case OSP_TEXTURE:
+  case OSP_TRANSFER_FUNCTION:
+  case OSP_VOLUME:
+  case OSP_PIXEL_OP:
+    return 1;
+  default:
+    return 0;
+  }
+}
+%}
+
+%typemap(in, fragment="NumPy_Fragments") (size_t numItems, OSPDataType, const void *source) (OSPObject *handles = NULL) {
+	PyObject *pyType, *pySource;
 	PyArrayObject *pyArray;
-	int i, len;
-	struct { int type; int div; } spec;
+	npy_intp i, len;
+	int npyType, components;
 	
 	if (!PyTuple_Check($input)) {
 		PyErr_SetString(PyExc_TypeError, "not a list");
@@ -76,63 +140,86 @@ import_array();
 	}
 	$2 = ($2_ltype)PyInt_AsLong(pyType);
 	
-	if ($2 == OSP_FLOAT3A) { spec.type = NPY_FLOAT32; spec.div = 4; }
-	else if ($2 == OSP_FLOAT4) { spec.type = NPY_FLOAT32; spec.div = 4; }
-	else if ($2 == OSP_INT3) { spec.type = NPY_INT32; spec.div = 3; }
-	else if ($2 == OSP_FLOAT3) { spec.type = NPY_FLOAT32; spec.div = 3; }
-	else if ($2 == OSP_LIGHT) { spec.type = NPY_OBJECT; spec.div = 1; }
-	else if ($2 == OSP_FLOAT) { spec.type = NPY_FLOAT32; spec.div = 1; }
-	else {
-		printf("%d\n", $2);
-		PyErr_SetString(PyExc_TypeError, "unimplemented OSPDataType");
-		SWIG_fail;
-	}
-	
-	pyArray = obj_to_array_no_conversion(pySource, spec.type);
-	if (pyArray == NULL) {
-		SWIG_fail;
-	}
-	
-	if (!require_contiguous(pyArray)) {
-		SWIG_fail;
-	}
-	
-	if (!require_native(pyArray)) {
-		SWIG_fail;
-	}
-	
-	if (!require_dimensions(pyArray, 1)) {
-		SWIG_fail;
-	}
-	
-	$3 = array_data(pySource);
-	len = array_size(pyArray, 0);
-	$1 = len / spec.div;
-
-	if ($2 == OSP_LIGHT) {
-		PyObject **po, *obj, *ospObj;
+	/* Objects are passed to OSPRay as an array of their handles, which
+	 * is freed once the call returns (OSPRay copies it). Any sequence
+	 * of managed objects works, including a NumPy object array. */
+	if (pyospray_is_object_type($2)) {
+		PyObject *seq, *ospObj;
 		SwigPyObject *sobj;
-		OSPLight **lights;
-		po = $3;
-		lights = malloc(len * sizeof(OSPLight *));
-		for (i=0; i<len; ++i) {
-			obj = *po++;
-			ospObj = PyObject_GetAttrString(obj, "_ospray_object");
+		
+		seq = PySequence_Fast(pySource, "source must be a sequence of objects");
+		if (seq == NULL) {
+			SWIG_fail;
+		}
+		
+		len = PySequence_Fast_GET_SIZE(seq);
+		handles = (OSPObject *)malloc((len > 0 ? len : 1) * sizeof(OSPObject));
+		if (handles == NULL) {
+			Py_DECREF(seq);
+			PyErr_NoMemory();
+			SWIG_fail;
+		}
+		for (i = 0; i < len; ++i) {
+			ospObj = PyObject_GetAttrString(PySequence_Fast_GET_ITEM(seq, i), "_ospray_object");
 			if (ospObj == NULL) {
+				Py_DECREF(seq);
 				PyErr_SetString(PyExc_TypeError, "Object has no _ospray_object");
 				SWIG_fail;
 			}
 			if (!SwigPyObject_Check(ospObj)) {
+				Py_DECREF(ospObj);
+				Py_DECREF(seq);
 				PyErr_SetString(PyExc_TypeError, "list must contain swig objects");
 				SWIG_fail;
 			}
 			sobj = SWIG_Python_GetSwigThis(ospObj);
-			*((OSPLight **)lights + i) = sobj->ptr;
+			handles[i] = (OSPObject)sobj->ptr;
+			Py_DECREF(ospObj);
+		}
+		Py_DECREF(seq);
+		
+		$1 = (size_t)len;
+		$3 = handles;
+	
+	} else {
+		if (!pyospray_data_spec($2, &npyType, &components)) {
+			PyErr_Format(PyExc_TypeError, "unimplemented OSPDataType %d", (int)$2);
+			SWIG_fail;
+		}
+		
+		/* Any C-contiguous, native byte order array of the right
+		 * element type is accepted as is, whatever its shape, so that
+		 * OSPRay reads straight from the array's memory. */
+		pyArray = obj_to_array_no_conversion(pySource, npyType);
+		if (pyArray == NULL) {
+			SWIG_fail;
+		}
+		
+		if (!require_contiguous(pyArray)) {
+			SWIG_fail;
 		}
-		$3 = lights;
+		
+		if (!require_native(pyArray)) {
+			SWIG_fail;
+		}
+		
+		len = PyArray_SIZE(pyArray);
+		if (len % components != 0) {
+			PyErr_Format(PyExc_ValueError,
+			             "array of %zd elements does not hold a whole number of %d-component items",
+			             (Py_ssize_t)len, components);
+			SWIG_fail;
+		}
+		
+		$3 = array_data(pyArray);
+		$1 = (size_t)(len / components);
 	}
 }
 
+%typemap(freearg) (size_t numItems, OSPDataType, const void *source) {
+	free(handles$argnum);
+}
+
 /*
 %typemap(in) (size_t numItems, OSPDataType, const void *source, const uint32_t dataCreationFlags) {
 	PyObject *pyType, *pySource, *pyFlags, *o;
@@ -321,6 +408,372 @@ ospToPixels(const char *format,
             const OSPFrameBuffer framebuffer,
             char **buffer, int *buflen);
 
+%{
+/* A mapped framebuffer channel, owned by the capsule that is the base
+ * of the NumPy array made over it. */
+typedef struct {
+  const void *mapped;
+  OSPFrameBuffer framebuffer;
+} pyospray_mapping;
+
+static void
+pyospray_mapping_destructor(PyObject *capsule) {
+  pyospray_mapping *mapping;
+  
+  mapping = (pyospray_mapping *)PyCapsule_GetPointer(capsule, "pyospray_mapping");
+  if (mapping->mapped != NULL) {
+    ospUnmapFrameBuffer(mapping->mapped, mapping->framebuffer);
+  }
+  free(mapping);
+}
+
+PyObject *
+ospMapFrameBufferArray(const OSPFrameBuffer framebuffer,
+                       OSPFrameBufferChannel channel,
+                       PyObject *dtype,
+                       PyObject *shape) {
+  PyArray_Descr *descr = NULL;
+  PyArray_Dims dims = { NULL, 0 };
+  pyospray_mapping *mapping;
+  PyObject *capsule, *array;
+  const void *mapped;
+  
+  if (!PyArray_DescrConverter(dtype, &descr)) {
+    return NULL;
+  }
+  
+  if (!PyArray_IntpConverter(shape, &dims)) {
+    Py_DECREF(descr);
+    return NULL;
+  }
+  
+  mapped = ospMapFrameBuffer(framebuffer, channel);
+  if (mapped == NULL) {
+    PyErr_Format(PyExc_RuntimeError, "framebuffer channel %d could not be mapped", (int)channel);
+    goto fail;
+  }
+  
+  mapping = (pyospray_mapping *)malloc(sizeof(pyospray_mapping));
+  if (mapping == NULL) {
+    ospUnmapFrameBuffer(mapped, framebuffer);
+    PyErr_NoMemory();
+    goto fail;
+  }
+  mapping->mapped = mapped;
+  mapping->framebuffer = framebuffer;
+  
+  capsule = PyCapsule_New(mapping, "pyospray_mapping", pyospray_mapping_destructor);
+  if (capsule == NULL) {
+    ospUnmapFrameBuffer(mapped, framebuffer);
+    free(mapping);
+    goto fail;
+  }
+  
+  /* The array is read-only because OSPRay hands out const memory. */
+  array = PyArray_NewFromDescr(&PyArray_Type, descr, dims.len, dims.ptr, NULL,
+                               (void *)mapped, NPY_ARRAY_C_CONTIGUOUS | NPY_ARRAY_ALIGNED, NULL);
+  PyDimMem_FREE(dims.ptr);
+  if (array == NULL) {
+    Py_DECREF(capsule);
+    return NULL;
+  }
+  
+  if (PyArray_SetBaseObject((PyArrayObject *)array, capsule) < 0) {
+    Py_DECREF(array);
+    return NULL;
+  }
+  
+  return array;
+
+fail:
+  Py_XDECREF(descr);
+  PyDimMem_FREE(dims.ptr);
+  return NULL;
+}
+
+PyObject *
+ospUnmapFrameBufferArray(PyObject *array) {
+  PyObject *base;
+  pyospray_mapping *mapping;
+  
+  if (!PyArray_Check(array)) {
+    PyErr_SetString(PyExc_TypeError, "not an array");
+    return NULL;
+  }
+  
+  base = PyArray_BASE((PyArrayObject *)array);
+  if (base == NULL || !PyCapsule_IsValid(base, "pyospray_mapping")) {
+    PyErr_SetString(PyExc_ValueError, "array is not a mapped framebuffer channel");
+    return NULL;
+  }
+  
+  mapping = (pyospray_mapping *)PyCapsule_GetPointer(base, "pyospray_mapping");
+  if (mapping->mapped != NULL) {
+    ospUnmapFrameBuffer(mapping->mapped, mapping->framebuffer);
+    mapping->mapped = NULL;
+  }
+  
+  Py_RETURN_NONE;
+}
+%}
+
+%nothread ospMapFrameBufferArray;
+PyObject *
+ospMapFrameBufferArray(const OSPFrameBuffer framebuffer,
+                       OSPFrameBufferChannel channel,
+                       PyObject *dtype,
+                       PyObject *shape);
+
+%nothread ospUnmapFrameBufferArray;
+PyObject *
+ospUnmapFrameBufferArray(PyObject *array);
+
+%{
+enum {
+  PYOSPRAY_RGB,
+  PYOSPRAY_RGBA,
+  PYOSPRAY_BGR,
+  PYOSPRAY_BGRA,
+  PYOSPRAY_GRAY,
+};
+
+/* Convert one row of 8-bit RGBA pixels. Each layout gets its own plain
+ * loop so the compiler can vectorize it. */
+static void
+pyospray_convert_row_u8(int layout, int width, const unsigned char *in, unsigned char *out) {
+  int x;
+  
+  switch (layout) {
+  case PYOSPRAY_RGBA:
+    memcpy(out, in, 4 * (size_t)width);
+    break;
+  case PYOSPRAY_RGB:
+    for (x = 0; x < width; x++) {
+      out[3*x + 0] = in[4*x + 0];
+      out[3*x + 1] = in[4*x + 1];
+      out[3*x + 2] = in[4*x + 2];
+    }
+    break;
+  case PYOSPRAY_BGRA:
+    for (x = 0; x < width; x++) {
+      out[4*x + 0] = in[4*x + 2];
+      out[4*x + 1] = in[4*x + 1];
+      out[4*x + 2] = in[4*x + 0];
+      out[4*x + 3] = in[4*x + 3];
+    }
+    break;
+  case PYOSPRAY_BGR:
+    for (x = 0; x < width; x++) {
+      out[3*x + 0] = in[4*x + 2];
+      out[3*x + 1] = in[4*x + 1];
+      out[3*x + 2] = in[4*x + 0];
+    }
+    break;
+  case PYOSPRAY_GRAY:
+    for (x = 0; x < width; x++) {
+      out[x] = (unsigned char)((77 * in[4*x + 0] + 150 * in[4*x + 1] + 29 * in[4*x + 2]) >> 8);
+    }
+    break;
+  }
+}
+
+static inline unsigned char
+pyospray_to_u8(float value) {
+  value = value < 0.0f ? 0.0f : value > 1.0f ? 1.0f : value;
+  return (unsigned char)(value * 255.0f + 0.5f);
+}
+
+/* Convert one row of float RGBA pixels to 8 bits per channel. */
+static void
+pyospray_convert_row_f32(int layout, int width, const float *in, unsigned char *out) {
+  int x;
+  
+  switch (layout) {
+  case PYOSPRAY_RGBA:
+    for (x = 0; x < 4 * width; x++) {
+      out[x] = pyospray_to_u8(in[x]);
+    }
+    break;
+  case PYOSPRAY_RGB:
+    for (x = 0; x < width; x++) {
+      out[3*x + 0] = pyospray_to_u8(in[4*x + 0]);
+      out[3*x + 1] = pyospray_to_u8(in[4*x + 1]);
+      out[3*x + 2] = pyospray_to_u8(in[4*x + 2]);
+    }
+    break;
+  case PYOSPRAY_BGRA:
+    for (x = 0; x < width; x++) {
+      out[4*x + 0] = pyospray_to_u8(in[4*x + 2]);
+      out[4*x + 1] = pyospray_to_u8(in[4*x + 1]);
+      out[4*x + 2] = pyospray_to_u8(in[4*x + 0]);
+      out[4*x + 3] = pyospray_to_u8(in[4*x + 3]);
+    }
+    break;
+  case PYOSPRAY_BGR:
+    for (x = 0; x < width; x++) {
+      out[3*x + 0] = pyospray_to_u8(in[4*x + 2]);
+      out[3*x + 1] = pyospray_to_u8(in[4*x + 1]);
+      out[3*x + 2] = pyospray_to_u8(in[4*x + 0]);
+    }
+    break;
+  case PYOSPRAY_GRAY:
+    for (x = 0; x < width; x++) {
+      out[x] = pyospray_to_u8(0.299f * in[4*x + 0] + 0.587f * in[4*x + 1] + 0.114f * in[4*x + 2]);
+    }
+    break;
+  }
+}
+
+PyObject *
+ospReadPixels(const OSPFrameBuffer framebuffer,
+              const osp_vec2i *size,
+              OSPFrameBufferFormat fbFormat,
+              const char *format,
+              int flip,
+              PyObject *out) {
+  Py_buffer view;
+  const void *pixel;
+  unsigned char *dst;
+  size_t rowlen;
+  int layout, channels, y, row;
+  
+  if (strcmp(format, "rgb") == 0) { layout = PYOSPRAY_RGB; channels = 3; }
+  else if (strcmp(format, "rgba") == 0) { layout = PYOSPRAY_RGBA; channels = 4; }
+  else if (strcmp(format, "bgr") == 0) { layout = PYOSPRAY_BGR; channels = 3; }
+  else if (strcmp(format, "bgra") == 0) { layout = PYOSPRAY_BGRA; channels = 4; }
+  else if (strcmp(format, "gray") == 0) { layout = PYOSPRAY_GRAY; channels = 1; }
+  else {
+    PyErr_Format(PyExc_ValueError, "unknown pixel format '%s'", format);
+    return NULL;
+  }
+  
+  if (fbFormat != OSP_FB_RGBA8 && fbFormat != OSP_FB_SRGBA && fbFormat != OSP_FB_RGBA32F) {
+    PyErr_SetString(PyExc_ValueError, "framebuffer has no color channel to read");
+    return NULL;
+  }
+  
+  if (PyObject_GetBuffer(out, &view, PyBUF_WRITABLE | PyBUF_C_CONTIGUOUS) < 0) {
+    return NULL;
+  }
+  
+  rowlen = (size_t)size->x * channels;
+  if ((size_t)view.len < rowlen * size->y) {
+    PyErr_Format(PyExc_ValueError, "output buffer holds %zd bytes but %zu are needed",
+                 view.len, rowlen * size->y);
+    PyBuffer_Release(&view);
+    return NULL;
+  }
+  dst = (unsigned char *)view.buf;
+  
+  Py_BEGIN_ALLOW_THREADS
+  pixel = ospMapFrameBuffer(framebuffer, OSP_FB_COLOR);
+  if (pixel != NULL) {
+    for (y = 0; y < size->y; y++) {
+      row = flip ? size->y - 1 - y : y;
+      if (fbFormat == OSP_FB_RGBA32F) {
+        pyospray_convert_row_f32(layout, size->x, (const float *)pixel + 4 * (size_t)row * size->x, dst + y * rowlen);
+      } else {
+        pyospray_convert_row_u8(layout, size->x, (const unsigned char *)pixel + 4 * (size_t)row * size->x, dst + y * rowlen);
+      }
+    }
+    ospUnmapFrameBuffer(pixel, framebuffer);
+  }
+  Py_END_ALLOW_THREADS
+  
+  PyBuffer_Release(&view);
+  if (pixel == NULL) {
+    PyErr_SetString(PyExc_RuntimeError, "framebuffer color channel could not be mapped");
+    return NULL;
+  }
+  Py_RETURN_NONE;
+}
+%}
+
+%nothread ospReadPixels;
+PyObject *
+ospReadPixels(const OSPFrameBuffer framebuffer,
+              const osp_vec2i *size,
+              OSPFrameBufferFormat fbFormat,
+              const char *format,
+              int flip,
+              PyObject *out);
+
+%{
+/* Set many parameters in one call. `params` is a sequence of
+ * (kind, name, args) tuples, where kind names the ospSet* function
+ * to use ("1i", "1f", "2f", "3f", "4f", "3i", "s", "d" or "o") and
+ * args is the tuple of values to pass it. */
+PyObject *
+ospSetParams(OSPObject object, PyObject *params) {
+  PyObject *seq, *args, *obj;
+  const char *kind, *name, *str;
+  Py_ssize_t i, len;
+  float f[4];
+  int n[3];
+  void *ptr;
+  
+  seq = PySequence_Fast(params, "params must be a sequence");
+  if (seq == NULL) {
+    return NULL;
+  }
+  
+  len = PySequence_Fast_GET_SIZE(seq);
+  for (i = 0; i < len; i++) {
+    if (!PyArg_ParseTuple(PySequence_Fast_GET_ITEM(seq, i), "syO!", &kind, &name, &PyTuple_Type, &args)) {
+      goto fail;
+    }
+    
+    if (strcmp(kind, "1i") == 0) {
+      if (!PyArg_ParseTuple(args, "i", &n[0])) goto fail;
+      ospSet1i(object, name, n[0]);
+    } else if (strcmp(kind, "1f") == 0) {
+      if (!PyArg_ParseTuple(args, "f", &f[0])) goto fail;
+      ospSet1f(object, name, f[0]);
+    } else if (strcmp(kind, "2f") == 0) {
+      if (!PyArg_ParseTuple(args, "ff", &f[0], &f[1])) goto fail;
+      ospSet2f(object, name, f[0], f[1]);
+    } else if (strcmp(kind, "3f") == 0) {
+      if (!PyArg_ParseTuple(args, "fff", &f[0], &f[1], &f[2])) goto fail;
+      ospSet3f(object, name, f[0], f[1], f[2]);
+    } else if (strcmp(kind, "4f") == 0) {
+      if (!PyArg_ParseTuple(args, "ffff", &f[0], &f[1], &f[2], &f[3])) goto fail;
+      ospSet4f(object, name, f[0], f[1], f[2], f[3]);
+    } else if (strcmp(kind, "3i") == 0) {
+      if (!PyArg_ParseTuple(args, "iii", &n[0], &n[1], &n[2])) goto fail;
+      ospSet3i(object, name, n[0], n[1], n[2]);
+    } else if (strcmp(kind, "s") == 0) {
+      if (!PyArg_ParseTuple(args, "y", &str)) goto fail;
+      ospSetString(object, name, str);
+    } else if (strcmp(kind, "d") == 0 || strcmp(kind, "o") == 0) {
+      if (!PyArg_ParseTuple(args, "O", &obj)) goto fail;
+      if (!SWIG_IsOK(SWIG_ConvertPtr(obj, &ptr, 0, 0))) {
+        PyErr_Format(PyExc_TypeError, "parameter '%s' is not an OSPRay object", name);
+        goto fail;
+      }
+      if (kind[0] == 'd') {
+        ospSetData(object, name, (OSPData)ptr);
+      } else {
+        ospSetObject(object, name, (OSPObject)ptr);
+      }
+    } else {
+      PyErr_Format(PyExc_ValueError, "unknown parameter kind '%s'", kind);
+      goto fail;
+    }
+  }
+  
+  Py_DECREF(seq);
+  Py_RETURN_NONE;
+
+fail:
+  Py_DECREF(seq);
+  return NULL;
+}
+%}
+
+%nothread ospSetParams;
+PyObject *
+ospSetParams(OSPObject object, PyObject *params);
+
 %include "carrays.i"
 %include "cdata.i"
 %array_class(unsigned char, ospByteBuffer)
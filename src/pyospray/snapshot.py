@@ -0,0 +1,262 @@
+"""
+Save and restore whole graphs of OSPRay objects
+
+A snapshot is a single uncompressed file: a small JSON header that
+records every object's class, parameters and references, followed by
+the raw payload of every :class:`~.Data` array, each aligned so that it
+can be memory-mapped in place. Restoring maps those payloads and hands
+them to OSPRay as shared buffers, so nothing is read or copied up front.
+
+"""
+
+from . import ManagedObject, Data, Geometry, Model, Material, FrameBuffer, Instance, commit_dirty, osp_vec2i, osp_affine3f
+from importlib import import_module
+import json
+import numpy as np
+
+
+__all__ = [
+	'save_snapshot', 'load_snapshot',
+]
+
+
+MAGIC = b'PYOSPSNP'
+VERSION = 1
+ALIGNMENT = 64
+
+
+def save_snapshot(path, *roots):
+	"""Write the objects reachable from `roots` to `path`.
+	
+	The graph is followed the same way as by
+	:func:`~.commit_dirty`. Only what was set through the Pythonic
+	interface (Committers, :meth:`~.Model.add` and
+	:meth:`~.Geometry.add`) is recorded.
+	
+	"""
+	order = []
+	ids = {}
+	
+	def visit(obj):
+		if id(obj) in ids:
+			return
+		ids[id(obj)] = None
+		for child in obj._children():
+			visit(child)
+		ids[id(obj)] = len(order)
+		order.append(obj)
+	
+	for root in roots:
+		visit(root)
+	
+	arrays = []
+	objects = [_encode_object(obj, ids, arrays) for obj in order]
+	
+	offset = 0
+	layout = []
+	for array in arrays:
+		offset = _align(offset)
+		layout.append({
+			'offset': offset,
+			'dtype': array.dtype.str,
+			'shape': list(array.shape),
+		})
+		offset += array.nbytes
+	
+	header = json.dumps({
+		'version': VERSION,
+		'roots': [ids[id(root)] for root in roots],
+		'objects': objects,
+		'arrays': layout,
+	}).encode('utf-8')
+	
+	start = _align(len(MAGIC) + 8 + len(header))
+	with open(path, 'wb') as f:
+		f.write(MAGIC)
+		f.write(len(header).to_bytes(8, 'little'))
+		f.write(header)
+		for array, entry in zip(arrays, layout):
+			f.write(b'\0' * (start + entry['offset'] - f.tell()))
+			f.write(memoryview(array).cast('B'))
+
+
+def load_snapshot(path):
+	"""Restore the objects saved in `path` and return the roots.
+	
+	Every object is recreated, its parameters are set in bulk and
+	the graph is committed. Arrays are memory-mapped read-only and
+	uploaded as shared buffers, so they are only read from disk as
+	OSPRay touches them.
+	
+	"""
+	with open(path, 'rb') as f:
+		if f.read(len(MAGIC)) != MAGIC:
+			raise ValueError(f'{path} is not a snapshot')
+		length = int.from_bytes(f.read(8), 'little')
+		header = json.loads(f.read(length).decode('utf-8'))
+	
+	if header['version'] != VERSION:
+		raise ValueError(f'unsupported snapshot version {header["version"]}')
+	
+	start = _align(len(MAGIC) + 8 + length)
+	arrays = []
+	for entry in header['arrays']:
+		shape = tuple(entry['shape'])
+		if 0 in shape:
+			arrays.append(np.empty(shape, dtype=entry['dtype']))
+			continue
+		arrays.append(np.memmap(path, dtype=entry['dtype'], mode='r', offset=start + entry['offset'], shape=shape))
+	
+	objects = []
+	for entry in header['objects']:
+		objects.append(_decode_object(entry, objects, arrays))
+	
+	roots = [objects[index] for index in header['roots']]
+	commit_dirty(*roots)
+	return roots
+
+
+def _align(offset):
+	"""Round `offset` up to the payload alignment."""
+	return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _encode_object(obj, ids, arrays):
+	"""Return the header entry for `obj`, collecting its arrays."""
+	cls = obj.__class__
+	entry = {
+		'class': f'{cls.__module__}:{cls.__qualname__}',
+		'state': _encode_state(obj, ids),
+		'params': {attr: _encode_value(value, ids) for attr, value in obj._params.items()},
+	}
+	
+	if isinstance(obj, Data):
+		entry['data'] = {'type': int(obj._type), 'flags': int(obj._flags)}
+		if obj._type in Data._object_types:
+			entry['data']['objects'] = [ids[id(item)] for item in obj._data]
+		else:
+			entry['data']['array'] = len(arrays)
+			arrays.append(np.ascontiguousarray(obj._data))
+	
+	if isinstance(obj, Model):
+		entry['members'] = [ids[id(member)] for key, member in obj._references.items() if isinstance(key, int)]
+	
+	if isinstance(obj, Geometry) and b'material' in obj._references:
+		entry['material'] = ids[id(obj._references[b'material'])]
+	
+	return entry
+
+
+def _decode_object(entry, objects, arrays):
+	"""Recreate the object described by a header entry."""
+	module, qualname = entry['class'].split(':')
+	cls = import_module(module)
+	for name in qualname.split('.'):
+		cls = getattr(cls, name)
+	
+	if 'data' in entry:
+		spec = entry['data']
+		if 'objects' in spec:
+			obj = Data(spec['type'], [objects[index] for index in spec['objects']], spec['flags'])
+		else:
+			obj = Data(spec['type'], arrays[spec['array']], spec['flags'] | Data.SHARED_BUFFER)
+	else:
+		obj = cls.__new__(cls)
+		_decode_state(obj, entry['state'], objects)
+	
+	obj.update({attr: _decode_value(value, objects) for attr, value in entry['params'].items()})
+	
+	for index in entry.get('members', ()):
+		obj.add(objects[index])
+	
+	if 'material' in entry:
+		obj.add(objects[entry['material']])
+	
+	return obj
+
+
+def _encode_state(obj, ids):
+	"""Return the constructor state of `obj` that is not a parameter."""
+	if isinstance(obj, Material):
+		return {'renderer': _encode_value(obj._renderer, {})}
+	elif isinstance(obj, FrameBuffer):
+		return {
+			'size': [obj._size.x, obj._size.y],
+			'format': int(obj._format),
+			'channels': int(obj._channels),
+		}
+	elif isinstance(obj, Instance):
+		if not isinstance(obj._model, ManagedObject):
+			raise TypeError('Instance of a raw OSPModel handle cannot be saved in a snapshot')
+		return {
+			'model': _encode_value(obj._model, ids),
+			'transform': _encode_transform(obj._transform),
+		}
+	else:
+		return {}
+
+
+def _decode_state(obj, state, objects):
+	"""Restore the constructor state saved by :func:`_encode_state`."""
+	if isinstance(obj, Material):
+		obj._renderer = _decode_value(state['renderer'], [])
+	elif isinstance(obj, FrameBuffer):
+		size = osp_vec2i()
+		size.x, size.y = state['size']
+		obj._size = size
+		obj._format = state['format']
+		obj._channels = state['channels']
+	elif isinstance(obj, Instance):
+		model = _decode_value(state['model'], objects)
+		Instance.__init__(obj, model, _decode_transform(state['transform']))
+
+
+def _encode_transform(transform):
+	"""Return an ``osp_affine3f`` as 12 floats, the columns then the offset."""
+	l = transform.l
+	return [
+		component
+		for vector in (l.vx, l.vy, l.vz, transform.p)
+		for component in (vector.x, vector.y, vector.z)
+	]
+
+
+def _decode_transform(values):
+	"""Return the ``osp_affine3f`` saved by :func:`_encode_transform`."""
+	transform = osp_affine3f()
+	l = transform.l
+	for index, vector in enumerate((l.vx, l.vy, l.vz, transform.p)):
+		vector.x, vector.y, vector.z = values[3 * index:3 * index + 3]
+	return transform
+
+
+def _encode_value(value, ids):
+	"""Return a JSON-compatible form of a parameter value."""
+	if isinstance(value, ManagedObject):
+		return {'ref': ids[id(value)]}
+	elif isinstance(value, bytes):
+		return {'bytes': value.decode('latin-1')}
+	elif isinstance(value, tuple):
+		return {'tuple': [_encode_value(item, ids) for item in value]}
+	elif isinstance(value, list):
+		return {'list': [_encode_value(item, ids) for item in value]}
+	elif isinstance(value, np.generic):
+		return value.item()
+	else:
+		return value
+
+
+def _decode_value(value, objects):
+	"""Return the parameter value saved by :func:`_encode_value`."""
+	if not isinstance(value, dict):
+		return value
+	elif 'ref' in value:
+		return objects[value['ref']]
+	elif 'bytes' in value:
+		return value['bytes'].encode('latin-1')
+	elif 'tuple' in value:
+		return tuple(_decode_value(item, objects) for item in value['tuple'])
+	elif 'list' in value:
+		return [_decode_value(item, objects) for item in value['list']]
+	else:
+		raise ValueError(f'cannot decode parameter value {value!r}')
@@ -0,0 +1,185 @@
+"""
+Render one large image as tiles across several processes
+
+A single OSPRay process doesn't scale linearly on machines with many
+sockets. A :class:`TiledRenderer` instead starts a pool of worker
+processes, each with its own ``ospInit`` and its own copy of the scene,
+and has them render sub-rectangles of the image (through the camera's
+``imageStart`` and ``imageEnd``) straight into shared memory.
+
+"""
+
+from . import ospInit, commit_dirty, FrameBuffer, osp_vec2i, OSP_NO_ERROR
+import multiprocessing
+import numpy as np
+import os
+import queue
+import time
+import traceback
+
+
+__all__ = [
+	'TiledRenderer',
+]
+
+
+class TiledRenderer:
+	"""Render stills as tiles in a pool of worker processes.
+	
+	Intended to be used like::
+	
+	  def make_scene():
+	      ...
+	      return renderer, camera
+	
+	  with TiledRenderer(make_scene, 7680, 4320, processes=8) as tiled:
+	      image = tiled.render({'pos': (0, 0, -10), 'dir': (0, 0, 1)})
+	
+	`factory` is called once in every worker, after ``ospInit``, and
+	must return a ``(renderer, camera)`` pair with the camera set on
+	the renderer. Since workers are started with the ``spawn`` method
+	it has to be picklable, e.g. a module-level function.
+	
+	Workers pull tiles from a shared queue as they finish the previous
+	one, so a worker that got cheap tiles simply renders more of them.
+	Tiles are handed out most expensive first, using the time each
+	took in the previous render, so the slowest ones don't end up
+	last.
+	
+	Each worker's OSPRay uses ``os.cpu_count() // processes`` threads
+	unless `threads` says otherwise.
+	
+	"""
+	
+	def __init__(self, factory, width, height, tile_size=256, processes=2, threads=None):
+		if threads is None:
+			threads = max(1, (os.cpu_count() or 1) // processes)
+		
+		self.width = width
+		self.height = height
+		self._tiles = [
+			(x, y, min(x + tile_size, width), min(y + tile_size, height))
+			for y in range(0, height, tile_size)
+			for x in range(0, width, tile_size)
+		]
+		self._costs = [0.0] * len(self._tiles)
+		self._job = 0
+		
+		context = multiprocessing.get_context('spawn')
+		self._image = context.RawArray('B', width * height * 4)
+		self._tasks = context.Queue()
+		self._results = context.Queue()
+		
+		init_args = [b'pyospray', b'--osp:numthreads', str(threads).encode('ascii')]
+		self._workers = [
+			context.Process(
+				target=_worker,
+				args=(factory, init_args, self._tasks, self._results, self._image, width, height),
+				daemon=True,
+			)
+			for _ in range(processes)
+		]
+		for worker in self._workers:
+			worker.start()
+	
+	def render(self, camera=None):
+		"""Render the image and return it.
+		
+		`camera` is an optional mapping of camera parameters to set
+		(with :meth:`~.ManagedObject.update`) before rendering, e.g.
+		a new position. The image is returned as a top-down
+		``(height, width, 4)`` uint8 array over the shared memory,
+		which the next render overwrites; copy it to keep it.
+		
+		"""
+		self._job += 1
+		order = sorted(range(len(self._tiles)), key=lambda index: -self._costs[index])
+		for index in order:
+			self._tasks.put((self._job, index, self._tiles[index], camera))
+		
+		errors = []
+		remaining = len(self._tiles)
+		while remaining:
+			try:
+				job, index, result = self._results.get(timeout=1.0)
+			except queue.Empty:
+				if not all(worker.is_alive() for worker in self._workers):
+					raise RuntimeError('a tile worker exited unexpectedly')
+				continue
+			if job != self._job:
+				continue
+			remaining -= 1
+			if isinstance(result, str):
+				errors.append(result)
+			else:
+				self._costs[index] = result
+		
+		if errors:
+			raise RuntimeError('rendering tiles failed:\n' + errors[0])
+		
+		return np.frombuffer(self._image, dtype=np.uint8).reshape(self.height, self.width, 4)
+	
+	def tile_times(self):
+		"""Return ``(tile, seconds)`` for each tile of the last render."""
+		return list(zip(self._tiles, self._costs))
+	
+	def close(self):
+		"""Stop the worker processes."""
+		for _ in self._workers:
+			self._tasks.put(None)
+		for worker in self._workers:
+			worker.join()
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, *exc_info):
+		self.close()
+
+
+def _worker(factory, init_args, tasks, results, image, width, height):
+	"""Render tiles from `tasks` into `image` until told to stop."""
+	error = ospInit(init_args)
+	if error != OSP_NO_ERROR:
+		raise RuntimeError(f'ospInit failed with {error}')
+	
+	renderer, camera = factory()
+	if 'aspect' in camera._committers:
+		camera.aspect = width / height
+	
+	pixels = np.frombuffer(image, dtype=np.uint8).reshape(height, width, 4)
+	framebuffers = {}
+	
+	while True:
+		task = tasks.get()
+		if task is None:
+			break
+		
+		job, index, (x0, y0, x1, y1), params = task
+		try:
+			start = time.monotonic()
+			if params:
+				camera.update(params)
+			
+			# Tiles are counted from the top, OSPRay's image
+			# coordinates from the bottom.
+			camera.imageStart = (x0 / width, 1 - y1 / height)
+			camera.imageEnd = (x1 / width, 1 - y0 / height)
+			
+			framebuffer = framebuffers.get((x1 - x0, y1 - y0))
+			if framebuffer is None:
+				size = osp_vec2i()
+				size.x = x1 - x0
+				size.y = y1 - y0
+				framebuffer = FrameBuffer(size, FrameBuffer.SRGBA, FrameBuffer.COLOR)
+				framebuffers[x1 - x0, y1 - y0] = framebuffer
+			
+			commit_dirty(renderer)
+			framebuffer.clear(FrameBuffer.COLOR)
+			renderer.render(framebuffer, FrameBuffer.COLOR)
+			with framebuffer.map(FrameBuffer.COLOR) as tile:
+				pixels[y0:y1, x0:x1] = tile[::-1]
+			
+			results.put((job, index, time.monotonic() - start))
+		except Exception:
+			results.put((job, index, traceback.format_exc()))
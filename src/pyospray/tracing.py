@@ -0,0 +1,135 @@
+"""
+Time what the Pythonic interface asks OSPRay to do
+
+A :class:`Tracer` records a span for every object created (with the
+bytes uploaded for data), every parameter set, commit, release and
+render, and exports them in the Chrome trace format that
+``chrome://tracing`` and Perfetto open. While no tracer is active, each
+of those calls only pays for one attribute check.
+
+"""
+
+from . import ManagedObject, Data
+from collections import defaultdict
+import json
+import os
+import threading
+import time
+
+
+__all__ = [
+	'Tracer',
+]
+
+
+class Tracer:
+	"""Record spans of OSPRay calls.
+	
+	Intended to be used like::
+	
+	  tracer = Tracer()
+	  with tracer:
+	      build_scene()
+	      render_frames()
+	  tracer.export('scene.trace.json')
+	
+	Spans are put in categories: ``'create'`` for new objects,
+	``'upload'`` for new data (with its size in bytes), ``'set'``,
+	``'commit'``, ``'release'`` and ``'render'``, and are named
+	after the class of the object involved. Subclasses can override
+	:meth:`~.Tracer.complete` to send spans elsewhere instead.
+	
+	At most `max_events` spans are kept; later ones are counted in
+	:attr:`dropped`. Only one tracer can be active at a time.
+	
+	"""
+	
+	def __init__(self, max_events=1000000):
+		self.max_events = max_events
+		self.dropped = 0
+		self._lock = threading.Lock()
+		self._events = []
+		self._pid = os.getpid()
+	
+	def start(self):
+		"""Start recording spans."""
+		if ManagedObject._tracer is not None and ManagedObject._tracer is not self:
+			raise RuntimeError('another tracer is already active')
+		ManagedObject._tracer = self
+	
+	def stop(self):
+		"""Stop recording spans."""
+		if ManagedObject._tracer is self:
+			ManagedObject._tracer = None
+	
+	def __enter__(self):
+		self.start()
+		return self
+	
+	def __exit__(self, *exc_info):
+		self.stop()
+	
+	@staticmethod
+	def now():
+		"""Return the current time for the start of a span."""
+		return time.perf_counter()
+	
+	def complete(self, start, category, name, args=None):
+		"""Record a span from `start` (from :meth:`now`) until now."""
+		end = time.perf_counter()
+		event = {
+			'name': name,
+			'cat': category,
+			'ph': 'X',
+			'ts': start * 1e6,
+			'dur': (end - start) * 1e6,
+			'pid': self._pid,
+			'tid': threading.get_ident(),
+		}
+		if args:
+			event['args'] = args
+		with self._lock:
+			if len(self._events) < self.max_events:
+				self._events.append(event)
+			else:
+				self.dropped += 1
+	
+	def created(self, start, obj):
+		"""Record the creation of `obj`'s OSPRay object."""
+		if isinstance(obj, Data) and obj._type not in Data._object_types:
+			nbytes = memoryview(obj._data).nbytes
+			self.complete(start, 'upload', 'Data', {'bytes': nbytes})
+		else:
+			self.complete(start, 'create', obj.__class__.__name__)
+	
+	def events(self):
+		"""Return a copy of the recorded events."""
+		with self._lock:
+			return list(self._events)
+	
+	def totals(self):
+		"""Return ``{(category, name): (count, seconds)}`` of the spans."""
+		totals = defaultdict(lambda: [0, 0.0])
+		for event in self.events():
+			total = totals[event['cat'], event['name']]
+			total[0] += 1
+			total[1] += event['dur'] / 1e6
+		return {key: tuple(value) for key, value in totals.items()}
+	
+	def chrome_trace(self):
+		"""Return the spans as a Chrome trace format dict."""
+		return {
+			'traceEvents': self.events(),
+			'displayTimeUnit': 'ms',
+		}
+	
+	def export(self, path):
+		"""Write the spans to `path` as Chrome trace format JSON."""
+		with open(path, 'w') as f:
+			json.dump(self.chrome_trace(), f)
+	
+	def clear(self):
+		"""Forget the recorded spans."""
+		with self._lock:
+			self._events.clear()
+			self.dropped = 0
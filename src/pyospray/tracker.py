@@ -0,0 +1,255 @@
+"""
+Track which OSPRay objects are alive and how much data they hold
+
+A :class:`ResourceTracker` sees every OSPRay object the Pythonic
+interface creates and releases. Its snapshots can be compared to check,
+for example, that serving a request in steady state leaves nothing
+behind.
+
+"""
+
+from . import ManagedObject, Data, ospRelease
+from collections import Counter, deque
+from dataclasses import dataclass, field
+import itertools
+import threading
+import traceback
+import weakref
+
+
+__all__ = [
+	'ResourceTracker', 'TrackerSnapshot',
+]
+
+
+class _Record:
+	"""What is known about one tracked OSPRay object."""
+	
+	__slots__ = ('tracker', 'serial', 'cls', 'type', 'nbytes', 'stack', 'released', 'finalizer')
+	
+	def __init__(self, tracker, serial, cls, type, nbytes, stack):
+		self.tracker = tracker
+		self.serial = serial
+		self.cls = cls
+		self.type = type
+		self.nbytes = nbytes
+		self.stack = stack
+		self.released = False
+		self.finalizer = None
+
+
+@dataclass
+class TrackerSnapshot:
+	"""Counts of live OSPRay objects at one point in time.
+	
+	`objects` maps class names to the number of live objects,
+	`data_bytes` maps Data types (e.g. ``'FLOAT3'``) to the bytes
+	held by live data of that type. `created` and `released` are
+	running totals.
+	
+	"""
+	
+	objects: dict = field(default_factory=dict)
+	data_bytes: dict = field(default_factory=dict)
+	created: int = 0
+	released: int = 0
+	
+	def diff(self, earlier):
+		"""Return what changed since the `earlier` snapshot.
+		
+		Only classes and types whose counts changed are kept, so
+		an :attr:`empty` diff means nothing was left allocated.
+		
+		"""
+		return TrackerSnapshot(
+			objects=_subtract(self.objects, earlier.objects),
+			data_bytes=_subtract(self.data_bytes, earlier.data_bytes),
+			created=self.created - earlier.created,
+			released=self.released - earlier.released,
+		)
+	
+	__sub__ = diff
+	
+	@property
+	def empty(self):
+		"""Whether no objects or data bytes are counted."""
+		return not self.objects and not self.data_bytes
+	
+	def as_dict(self):
+		"""Return the snapshot as a JSON-compatible dict."""
+		return {
+			'objects': dict(self.objects),
+			'data_bytes': dict(self.data_bytes),
+			'created': self.created,
+			'released': self.released,
+		}
+
+
+class ResourceTracker:
+	"""Register the creation and release of every OSPRay object.
+	
+	Intended to be used like::
+	
+	  tracker = ResourceTracker(sample_every=10)
+	  with tracker:
+	      before = tracker.snapshot()
+	      handle_request()
+	      assert (tracker.snapshot() - before).empty
+	
+	With `sample_every` set, the creation stack of every n-th object
+	is kept (see :meth:`~.ResourceTracker.live`). With
+	`release_unreachable`, objects whose Python wrapper is garbage
+	collected without having been released are released then,
+	instead of leaking; objects set on other objects are kept alive
+	by them, so this never releases anything still in use.
+	
+	Only one tracker can be active at a time.
+	
+	"""
+	
+	def __init__(self, sample_every=0, release_unreachable=False, stack_limit=16):
+		self.sample_every = sample_every
+		self.release_unreachable = release_unreachable
+		self.stack_limit = stack_limit
+		self._lock = threading.Lock()
+		self._serials = itertools.count()
+		self._live = {}
+		self._collected_records = deque()
+		self._created = 0
+		self._released = 0
+	
+	def start(self):
+		"""Start tracking objects created from now on."""
+		if ManagedObject._tracker is not None and ManagedObject._tracker is not self:
+			raise RuntimeError('another tracker is already active')
+		ManagedObject._tracker = self
+	
+	def stop(self):
+		"""Stop tracking new objects.
+		
+		Objects already tracked keep being counted until released.
+		
+		"""
+		if ManagedObject._tracker is self:
+			ManagedObject._tracker = None
+	
+	def __enter__(self):
+		self.start()
+		return self
+	
+	def __exit__(self, *exc_info):
+		self.stop()
+	
+	def snapshot(self):
+		"""Return a :class:`~.TrackerSnapshot` of the live objects."""
+		objects = Counter()
+		data_bytes = Counter()
+		with self._lock:
+			self._forget_collected()
+			for record in self._live.values():
+				objects[record.cls] += 1
+				if record.type is not None:
+					data_bytes[record.type] += record.nbytes
+			return TrackerSnapshot(dict(objects), dict(data_bytes), self._created, self._released)
+	
+	def live(self, cls=None):
+		"""Return ``(class, nbytes, stack)`` for each live object.
+		
+		`stack` is the formatted creation stack for sampled objects
+		and None for the others. Pass a class name as `cls` to only
+		list objects of that class.
+		
+		"""
+		with self._lock:
+			self._forget_collected()
+			records = list(self._live.values())
+		return [
+			(record.cls, record.nbytes, record.stack)
+			for record in records
+			if cls is None or record.cls == cls
+		]
+	
+	def _created_object(self, obj, handle):
+		"""Start tracking the OSPRay object `handle` of `obj`."""
+		serial = next(self._serials)
+		
+		stack = None
+		if self.sample_every and serial % self.sample_every == 0:
+			stack = ''.join(traceback.format_list(traceback.extract_stack(limit=self.stack_limit)[:-2]))
+		
+		type = None
+		nbytes = 0
+		if isinstance(obj, Data):
+			type = _data_type_name(obj._type)
+			if obj._type not in Data._object_types:
+				nbytes = memoryview(obj._data).nbytes
+		
+		record = _Record(self, serial, obj.__class__.__name__, type, nbytes, stack)
+		with self._lock:
+			self._forget_collected()
+			self._live[serial] = record
+			self._created += 1
+		
+		record.finalizer = weakref.finalize(obj, self._collected, record, handle)
+		obj._tracker_record = record
+	
+	def _released(self, record):
+		"""Stop tracking an object that has been released."""
+		if record.released:
+			return
+		record.finalizer.detach()
+		self._forget(record)
+	
+	def _collected(self, record, handle):
+		"""Handle the wrapper of a tracked object being collected.
+		
+		This runs from the garbage collector, possibly in the middle
+		of a block holding the lock in the same thread, so the record
+		is only queued here and forgotten by the next such block.
+		
+		"""
+		if record.released or not self.release_unreachable:
+			return
+		record.released = True
+		ospRelease(handle)
+		self._collected_records.append(record)
+	
+	def _forget(self, record):
+		"""Count a tracked object as released."""
+		with self._lock:
+			record.released = True
+			self._live.pop(record.serial, None)
+			self._released += 1
+			self._forget_collected()
+	
+	def _forget_collected(self):
+		"""Count the queued collected objects as released.
+		
+		Must be called with the lock held.
+		
+		"""
+		while self._collected_records:
+			record = self._collected_records.popleft()
+			self._live.pop(record.serial, None)
+			self._released += 1
+
+
+def _subtract(later, earlier):
+	"""Return the non-zero differences between two count dicts."""
+	keys = set(later) | set(earlier)
+	diff = {key: later.get(key, 0) - earlier.get(key, 0) for key in keys}
+	return {key: value for key, value in diff.items() if value}
+
+
+_data_type_names = None
+
+def _data_type_name(type):
+	"""Return the name of a Data type constant, e.g. ``'FLOAT3'``."""
+	global _data_type_names
+	if _data_type_names is None:
+		_data_type_names = {
+			value: name
+			for name, value in vars(Data).items()
+			if name.isupper() and isinstance(value, int) and name not in ('NONE', 'SHARED_BUFFER')
+		}
+	return _data_type_names.get(type, str(type))